@@ -0,0 +1,148 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from starlette.datastructures import MutableHeaders
+
+import local_constants
+import metrics
+
+logger = logging.getLogger("f1.requests")
+if local_constants.REQUEST_LOG and not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+READ_OPERATIONS = {"get", "stream", "head", "download"}
+
+_current = contextvars.ContextVar("request_cost", default=None)
+
+
+class RequestCost:
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.documents_read = 0
+        self.documents_written = 0
+        self.backend_calls = 0
+        self.document_gets = {}
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, duration):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def add_backend_call(self, backend, operation, collection, duration, documents):
+        with self._lock:
+            self.backend_calls += 1
+            self.phases[backend] = self.phases.get(backend, 0.0) + duration
+            if operation in READ_OPERATIONS:
+                self.documents_read += documents
+            else:
+                self.documents_written += documents
+            if backend == "firestore" and operation == "get":
+                self.document_gets[collection] = self.document_gets.get(collection, 0) + 1
+
+    def n_plus_one(self):
+        # A page that fetches one document per item shows up as many single gets on one collection
+        threshold = local_constants.N_PLUS_ONE_THRESHOLD
+        return {collection: count for collection, count in self.document_gets.items() if count > threshold}
+
+    def server_timing(self, total):
+        entries = []
+        for name, duration in self.phases.items():
+            entry = f"{name};dur={duration * 1000:.2f}"
+            if name == "firestore":
+                entry += f';desc="{self.documents_read} read, {self.documents_written} written"'
+            entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+
+    def log_record(self, total):
+        return {
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "duration_ms": round(total * 1000, 2),
+            "phases_ms": {name: round(duration * 1000, 2) for name, duration in self.phases.items()},
+            "backend_calls": self.backend_calls,
+            "documents_read": self.documents_read,
+            "documents_written": self.documents_written,
+            "n_plus_one": self.n_plus_one(),
+        }
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    cost = _current.get()
+    if cost is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        cost.add_phase(name, time.perf_counter() - started)
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_backend_call(backend, operation, collection, duration, documents, error, latency):
+    cost = _current.get()
+    if cost is not None:
+        cost.add_backend_call(backend, operation, collection, duration, documents)
+
+
+class AccountingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        cost = RequestCost(scope["method"], scope["path"])
+        token = _current.set(cost)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                cost.status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", cost.server_timing(time.perf_counter() - cost.started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            total = time.perf_counter() - cost.started
+            cost.route = metrics.route_label(scope)
+            record = cost.log_record(total)
+            if record["n_plus_one"]:
+                logger.warning(json.dumps(record))
+            else:
+                logger.info(json.dumps(record))
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import metrics
+
+# Monitoring has to keep answering when the app is saturated
+EXEMPT_PREFIXES = ("/metrics", "/healthz", "/readyz", "/static/", "/blobs/", "/admin/")
+# GET pages that stream whole collections
+QUERY_PAGES = ("/", "/drivers", "/teams", "/compare/drivers", "/compare/teams")
+
+
+def route_group(scope):
+    path = scope["path"]
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    if path.startswith("/img/"):
+        return "images"
+    if scope["method"] in ("GET", "HEAD"):
+        if path in QUERY_PAGES or path.startswith(("/export/", "/analytics/")):
+            return "queries"
+        return "reads"
+    if path.endswith("/query") or path.startswith("/compare/"):
+        return "queries"
+    if path.startswith("/blob-uploads/"):
+        return "uploads"
+    for name, value in scope["headers"]:
+        if name == b"content-type" and value.startswith(b"multipart/form-data"):
+            return "uploads"
+    return "writes"
+
+
+class Limiter:
+    def __init__(self, group, limit, queue):
+        self.group = group
+        self.queue = queue
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self, timeout):
+        # Returns the rejection reason, or None once a slot is held
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return None
+        if self.waiting >= self.queue:
+            return "queue_full"
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return "queue_timeout"
+        finally:
+            self.waiting -= 1
+        return None
+
+    def release(self):
+        self._semaphore.release()
+
+
+class AdmissionMiddleware:
+    # Caps concurrent requests per route group, with a bounded wait queue, so a burst of
+    # expensive pages or uploads can't take every slot from cheap ones. Excess requests
+    # get 503 + Retry-After straight away instead of piling up.
+
+    def __init__(self, app, limits, queue_timeout, retry_after=1):
+        self.app = app
+        self.limiters = {group: Limiter(group, limit, queue) for group, (limit, queue) in limits.items()}
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiters.get(route_group(scope)) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        rejected = await limiter.acquire(self.queue_timeout)
+        metrics.ADMISSION_QUEUE_TIME.labels(limiter.group).observe(time.perf_counter() - started)
+        if rejected:
+            metrics.ADMISSION_REJECTED.labels(limiter.group, rejected).inc()
+            await self._reject(send)
+            return
+        metrics.ADMISSION_IN_FLIGHT.labels(limiter.group).inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metrics.ADMISSION_IN_FLIGHT.labels(limiter.group).dec()
+            limiter.release()
+
+    async def _reject(self, send):
+        body = b"The server is busy. Please try again shortly."
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import threading
+import time
+import weakref
+
+from starlette.concurrency import run_in_threadpool
+
+import export
+import metrics
+import records
+
+AGGREGATES = ("count", "sum", "mean", "min", "max")
+WRITE_OPERATIONS = {"create", "set", "update", "delete", "add", "commit"}
+MAX_BINS = 100
+
+
+class AnalyticsError(Exception):
+    pass
+
+
+class GroupIndex:
+    # Rows sorted by group code, computed once per table: every aggregate over the same
+    # grouping is then one reduceat over contiguous runs
+    def __init__(self, codes, group_count):
+        import numpy as np
+        self.order = np.argsort(codes, kind="stable")
+        self.counts = np.bincount(codes, minlength=group_count)
+        self.present = np.flatnonzero(self.counts)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))[self.present]
+
+    def aggregate(self, values, present, aggregate):
+        # `present` marks rows holding a value (None: all do); the rest are skipped, as
+        # SQL skips nulls. Returns a list with None for groups without any value.
+        import numpy as np
+        ordered = values[self.order]
+        if present is None:
+            counts = self.counts[self.present]
+        else:
+            ordered_present = present[self.order]
+            counts = np.add.reduceat(ordered_present.astype(np.int64), self.starts)
+        if aggregate == "count":
+            return counts.tolist()
+        if aggregate in ("min", "max"):
+            if present is not None:
+                # Fill gaps with a value that can never win
+                limits = np.iinfo(ordered.dtype) if ordered.dtype.kind == "i" else np.finfo(ordered.dtype)
+                ordered = np.where(ordered_present, ordered, limits.max if aggregate == "min" else limits.min)
+            reduce = np.minimum if aggregate == "min" else np.maximum
+            result = reduce.reduceat(ordered, self.starts)
+        else:
+            result = np.add.reduceat(ordered, self.starts)
+            if aggregate == "mean":
+                result = result / np.maximum(counts, 1)
+        return [value if count else None for value, count in zip(result.tolist(), counts.tolist())]
+
+
+def _whole(values, present, aggregate):
+    if present is not None:
+        values = values[present]
+    if aggregate == "count":
+        return len(values)
+    if not len(values):
+        return None
+    if aggregate == "mean":
+        return float(values.mean())
+    return getattr(values, aggregate)().item()
+
+
+class AnalyticsStore:
+    # Keeps one ColumnTable per collection and caches query results per table version.
+    # A write seen by the backend observer (in this worker) drops the table; writes from
+    # other workers are picked up once it is `ttl` seconds old.
+
+    def __init__(self, load, ttl, max_results=256):
+        self.load = load
+        self.ttl = ttl
+        self.max_results = max_results
+        self._tables = {}
+        self._written = set()
+        self._versions = collections.Counter()
+        self._results = collections.OrderedDict()
+        # Dropped along with the table they were built for
+        self._group_indexes = weakref.WeakKeyDictionary()
+        self._locks = collections.defaultdict(asyncio.Lock)
+        self._lock = threading.Lock()
+
+    def invalidate(self, collection=None):
+        with self._lock:
+            for name in [collection] if collection else list(export.EXPORT_FIELDS):
+                self._tables.pop(name, None)
+                self._written.add(name)
+
+    def observe_backend_call(self, backend, operation, collection, duration, documents, error, latency):
+        if backend != "firestore" or operation not in WRITE_OPERATIONS or error is not None:
+            return
+        # Batch commits aren't labelled with a collection
+        if collection == "batch":
+            self.invalidate()
+        elif collection in export.EXPORT_FIELDS:
+            self.invalidate(collection)
+
+    def cached_table(self, collection):
+        # The loaded table while it is fresh, without ever starting a load
+        entry = self._tables.get(collection)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    async def table(self, collection):
+        entry = self._tables.get(collection)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0], entry[2]
+        async with self._locks[collection]:
+            entry = self._tables.get(collection)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                loaded_at = time.monotonic()
+                with self._lock:
+                    self._written.discard(collection)
+                table = await run_in_threadpool(self.load, collection)
+                with self._lock:
+                    # A write during the load may be missing from it: serve it once, reload next time
+                    if collection in self._written:
+                        loaded_at = float("-inf")
+                    self._versions[collection] += 1
+                    entry = (table, loaded_at, self._versions[collection])
+                    self._tables[collection] = entry
+            return entry[0], entry[2]
+
+    def _cached(self, key, compute):
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                metrics.record_cache("analytics", True)
+                return self._results[key]
+        metrics.record_cache("analytics", False)
+        result = compute()
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return result
+
+    def _group_index(self, table, group_by):
+        with self._lock:
+            indexes = self._group_indexes.setdefault(table, {})
+        if group_by not in indexes:
+            indexes[group_by] = GroupIndex(table.column(group_by), len(table.categories[group_by]))
+        return indexes[group_by]
+
+    async def group_by(self, collection, group_by, fields, aggregates):
+        table, version = await self.table(collection)
+        _check_fields(table, fields)
+        if group_by is not None and group_by not in table.categories:
+            if not table.categories:
+                raise AnalyticsError(f"{collection} have no field to group by")
+            raise AnalyticsError(f"{collection} can only be grouped by {', '.join(sorted(table.categories))}")
+        for aggregate in aggregates:
+            if aggregate not in AGGREGATES:
+                raise AnalyticsError(f"Unknown aggregate {aggregate}; use {', '.join(AGGREGATES)}")
+
+        def compute():
+            if group_by is None:
+                return {"version": version, "rows": len(table), "aggregates": {
+                    field: {aggregate: _whole(*table.numbers(field), aggregate) for aggregate in aggregates}
+                    for field in fields
+                }}
+            if not len(table):
+                return {"version": version, "rows": 0, "group_by": group_by, "groups": []}
+            index = self._group_index(table, group_by)
+            names = [table.categories[group_by][code] for code in index.present.tolist()]
+            stats = {
+                field: {aggregate: index.aggregate(*table.numbers(field), aggregate) for aggregate in aggregates}
+                for field in fields
+            }
+            groups = [
+                {group_by: name, **{field: {aggregate: stats[field][aggregate][position] for aggregate in aggregates}
+                                    for field in fields}}
+                for position, name in enumerate(names)
+            ]
+            return {"version": version, "rows": len(table), "group_by": group_by, "groups": groups}
+
+        return self._cached((collection, version, "group_by", group_by, tuple(fields), tuple(aggregates)), compute)
+
+    async def histogram(self, collection, field, bins):
+        table, version = await self.table(collection)
+        _check_fields(table, [field])
+        if not 1 <= bins <= MAX_BINS:
+            raise AnalyticsError(f"bins must be between 1 and {MAX_BINS}")
+
+        def compute():
+            import numpy as np
+            values, present = table.numbers(field)
+            counts, edges = np.histogram(values if present is None else values[present], bins=bins)
+            return {"version": version, "rows": len(table), "field": field,
+                    "edges": edges.tolist(), "counts": counts.tolist()}
+
+        return self._cached((collection, version, "histogram", field, bins), compute)
+
+
+def _check_fields(table, fields):
+    if not fields:
+        raise AnalyticsError("Pick at least one field")
+    for field in fields:
+        if field not in table.numeric:
+            raise AnalyticsError(f"Unknown numeric field {field}; use {', '.join(table.numeric)}")
+
+
+def load_table(document_store, collection):
+    return records.ColumnTable.from_documents(collection, document_store.collection(collection).stream())
@@ -0,0 +1,864 @@
+import copy
+import datetime
+import hashlib
+import hmac
+import os
+import shutil
+import threading
+import time
+import uuid
+from urllib.parse import quote, unquote, urlencode, urlparse
+
+import local_constants
+
+# In-memory document store
+#
+# Implements the subset of the google.cloud.firestore client API that the app
+# uses, so handlers run unchanged against it. Intended for local runs, load
+# tests and profiling without GCP credentials or network access.
+
+DOCUMENT_ID = "__name__"
+# Resumable uploads send (and buffer) this much at a time; must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class AlreadyExists(ValueError):
+    # Raised by the in-memory store's create(); Firestore raises google.api_core's Conflict
+    pass
+
+
+def _compare(op, field_value, value):
+    # As in Firestore, a null field only matches == null or an `in` list holding null
+    if field_value is None and op not in ("==", "in"):
+        return False
+    try:
+        if op == "==":
+            return field_value == value
+        if op == "!=":
+            return field_value != value
+        if op == "<":
+            return field_value < value
+        if op == "<=":
+            return field_value <= value
+        if op == ">":
+            return field_value > value
+        if op == ">=":
+            return field_value >= value
+        if op == "in":
+            return field_value in value
+        if op == "not-in":
+            return field_value not in value
+        if op == "array_contains":
+            return isinstance(field_value, list) and value in field_value
+        if op == "array_contains_any":
+            return isinstance(field_value, list) and any(v in field_value for v in value)
+    except TypeError:
+        # Firestore only matches values of the same type; mixed comparisons never match
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+def _field_predicate(field_path, op, value):
+    def predicate(doc_id, data):
+        if field_path == DOCUMENT_ID:
+            return _compare(op, doc_id, value)
+        if field_path not in data:
+            return False
+        return _compare(op, data[field_path], value)
+    return predicate
+
+
+def _filter_predicate(filter):
+    # Accepts firestore.FieldFilter / And / Or objects by duck typing
+    if hasattr(filter, "filters"):
+        predicates = [_filter_predicate(f) for f in filter.filters]
+        if getattr(filter.operator, "name", filter.operator) == "OR":
+            return lambda doc_id, data: any(p(doc_id, data) for p in predicates)
+        return lambda doc_id, data: all(p(doc_id, data) for p in predicates)
+    return _field_predicate(filter.field_path, filter.op_string, filter.value)
+
+
+class MemorySnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return self._data[field_path]
+
+
+class MemoryDocumentReference:
+    def __init__(self, store, collection_name, document_id):
+        self._store = store
+        self._collection_name = collection_name
+        self.id = document_id
+
+    @property
+    def path(self):
+        return f"{self._collection_name}/{self.id}"
+
+    def get(self, timeout=None):
+        return MemorySnapshot(self, self._store._read(self._collection_name, self.id))
+
+    def create(self, document_data):
+        self._store._write(self._collection_name, self.id, document_data, mode="create")
+
+    def set(self, document_data, merge=False):
+        self._store._write(self._collection_name, self.id, document_data, mode="merge" if merge else "set")
+
+    def update(self, field_updates):
+        self._store._write(self._collection_name, self.id, field_updates, mode="update")
+
+    def delete(self):
+        self._store._delete(self._collection_name, self.id)
+
+
+class MemoryQuery:
+    def __init__(self, store, collection_name, predicates=(), orders=(), limit=None, start_after=None):
+        self._store = store
+        self._collection_name = collection_name
+        self._predicates = tuple(predicates)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = {
+            "predicates": self._predicates,
+            "orders": self._orders,
+            "limit": self._limit,
+            "start_after": self._start_after,
+        }
+        state.update(changes)
+        return MemoryQuery(self._store, self._collection_name, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            predicate = _filter_predicate(filter)
+        else:
+            predicate = _field_predicate(field_path, op_string, value)
+        return self._copy(predicates=self._predicates + (predicate,))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction == "DESCENDING"),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def _sort_key(self, field_path, doc_id, data):
+        value = doc_id if field_path == DOCUMENT_ID else data.get(field_path)
+        # Rank by type first, as Firestore does, so mixed-type fields still sort
+        if isinstance(value, bool):
+            return (1, value)
+        if isinstance(value, (int, float)):
+            return (2, value)
+        if isinstance(value, str):
+            return (3, value)
+        return (0 if value is None else 4, str(value))
+
+    def _is_after(self, row, cursor_key, orders):
+        for (field_path, descending), cursor_value in zip(orders, cursor_key):
+            value = self._sort_key(field_path, *row)
+            if value != cursor_value:
+                return value < cursor_value if descending else value > cursor_value
+        return False
+
+    def _matches(self):
+        rows = [(doc_id, data) for doc_id, data in self._store._scan(self._collection_name)
+                if all(predicate(doc_id, data) for predicate in self._predicates)]
+        orders = self._orders or ((DOCUMENT_ID, False),)
+        # Firestore leaves out documents that lack an order_by field
+        rows = [(doc_id, data) for doc_id, data in rows
+                if all(f == DOCUMENT_ID or f in data for f, _ in orders)]
+        # Stable sorts applied from the last key to the first give a multi-key ordering
+        for field_path, descending in reversed(orders):
+            rows.sort(key=lambda row: self._sort_key(field_path, *row), reverse=descending)
+        if self._start_after is not None:
+            cursor = self._start_after
+            if isinstance(cursor, MemorySnapshot):
+                cursor_id, cursor_data = cursor.id, cursor._data
+            else:
+                cursor_id, cursor_data = cursor.get("id"), cursor
+            cursor_key = [self._sort_key(f, cursor_id, cursor_data) for f, _ in orders]
+            rows = [row for row in rows if self._is_after(row, cursor_key, orders)]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return rows
+
+    def stream(self, timeout=None):
+        for doc_id, data in self._matches():
+            reference = MemoryDocumentReference(self._store, self._collection_name, doc_id)
+            yield MemorySnapshot(reference, copy.deepcopy(data))
+
+    def get(self, timeout=None):
+        return list(self.stream(timeout=timeout))
+
+
+class MemoryCollection(MemoryQuery):
+    def __init__(self, store, collection_name):
+        super().__init__(store, collection_name)
+        self.id = collection_name
+
+    def document(self, document_id=None):
+        return MemoryDocumentReference(self._store, self._collection_name, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        reference.create(document_data)
+        return None, reference
+
+
+class MemoryWriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def create(self, reference, document_data):
+        self._writes.append((reference, "create", document_data))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append((reference, "merge" if merge else "set", document_data))
+
+    def update(self, reference, field_updates):
+        self._writes.append((reference, "update", field_updates))
+
+    def delete(self, reference):
+        self._writes.append((reference, "delete", None))
+
+    def commit(self):
+        with self._store._lock:
+            for reference, mode, data in self._writes:
+                if mode == "delete":
+                    self._store._delete(reference._collection_name, reference.id)
+                else:
+                    self._store._write(reference._collection_name, reference.id, data, mode=mode)
+        self._writes = []
+
+
+class MemoryDocumentStore:
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.RLock()
+
+    def collection(self, collection_name):
+        return MemoryCollection(self, collection_name)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def _read(self, collection_name, document_id):
+        with self._lock:
+            data = self._collections.get(collection_name, {}).get(document_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _scan(self, collection_name):
+        with self._lock:
+            return list(self._collections.get(collection_name, {}).items())
+
+    def _write(self, collection_name, document_id, data, mode):
+        with self._lock:
+            documents = self._collections.setdefault(collection_name, {})
+            if mode == "create" and document_id in documents:
+                raise AlreadyExists(f"Document already exists: {collection_name}/{document_id}")
+            if mode == "update" and document_id not in documents:
+                raise ValueError(f"No document to update: {collection_name}/{document_id}")
+            if mode in ("merge", "update") and document_id in documents:
+                documents[document_id] = {**documents[document_id], **copy.deepcopy(data)}
+            else:
+                documents[document_id] = copy.deepcopy(data)
+
+    def _delete(self, collection_name, document_id):
+        with self._lock:
+            self._collections.get(collection_name, {}).pop(document_id, None)
+
+
+# Lazy, fork-aware clients
+
+
+class LazyClient:
+    # Builds the wrapped client on first use in each process. gRPC channels and HTTP
+    # sessions must not be shared across a fork, so a pre-fork server can import the
+    # app in the master and every worker still gets its own connections.
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    self._client = self._factory()
+                    self._pid = pid
+        return self._client
+
+    def reset(self):
+        self._client = None
+        self._pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+
+# Blob stores
+
+
+class BlobStore:
+    def upload(self, path, file_obj, content_type=None):
+        """Store the file at path and return its public URL."""
+        raise NotImplementedError
+
+    def delete(self, path):
+        """Delete the file at path; a file that is already gone is not an error."""
+        raise NotImplementedError
+
+    def path_from_url(self, url):
+        """Return the blob path for a public URL produced by this store, or None."""
+        raise NotImplementedError
+
+    def probe(self):
+        """Make one cheap call that fails if the store is unreachable."""
+        raise NotImplementedError
+
+    def open_writer(self, path, content_type=None):
+        """Return a writer for path: write(data), close() -> public URL, abort()."""
+        raise NotImplementedError
+
+    def signed_upload_url(self, path, content_type, expires):
+        """Return a URL the browser can PUT the file to directly for `expires` seconds."""
+        raise NotImplementedError
+
+    def head(self, path, length):
+        """Return (size, first `length` bytes) of a stored file, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def publish(self, path):
+        """Make a stored file public and return its URL."""
+        raise NotImplementedError
+
+    def public_url(self, path):
+        """Return the URL a file will be served from once it is public."""
+        raise NotImplementedError
+
+    def download_public(self, path):
+        """Return a published file's bytes, or None if it doesn't exist or is still private."""
+        raise NotImplementedError
+
+
+class GCSBlobStore(BlobStore):
+    def __init__(self, project, bucket_name):
+        self.project = project
+        self.bucket_name = bucket_name
+        self.bucket = LazyClient(self._create_bucket)
+        self.anonymous_bucket = LazyClient(self._create_anonymous_bucket)
+
+    def _create_bucket(self):
+        from google.cloud import storage
+        return storage.Client(project=self.project).bucket(self.bucket_name)
+
+    def _create_anonymous_bucket(self):
+        from google.cloud import storage
+        return storage.Client.create_anonymous_client().bucket(self.bucket_name)
+
+    def upload(self, path, file_obj, content_type=None):
+        blob = self.bucket.blob(path)
+        blob.upload_from_file(file_obj, content_type=content_type)
+        blob.make_public()
+        return blob.public_url
+
+    def delete(self, path):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(path).delete()
+        except NotFound:
+            pass
+
+    def path_from_url(self, url):
+        prefix = f"/{self.bucket_name}/"
+        parsed_url = urlparse(url)
+        if parsed_url.netloc != "storage.googleapis.com" or not parsed_url.path.startswith(prefix):
+            return None
+        return unquote(parsed_url.path[len(prefix):])
+
+    def probe(self):
+        list(self.bucket.list_blobs(max_results=1))
+
+    def open_writer(self, path, content_type=None):
+        return GCSBlobWriter(self.bucket.blob(path), content_type)
+
+    def signed_upload_url(self, path, content_type, expires):
+        # Needs credentials that can sign: a service account key, or the IAM signBlob permission
+        return self.bucket.blob(path).generate_signed_url(
+            version="v4", expiration=datetime.timedelta(seconds=expires), method="PUT", content_type=content_type)
+
+    def head(self, path, length):
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            return None
+        return blob.size, blob.download_as_bytes(start=0, end=length - 1) if blob.size else b""
+
+    def publish(self, path):
+        blob = self.bucket.blob(path)
+        blob.make_public()
+        return blob.public_url
+
+    def public_url(self, path):
+        return self.bucket.blob(path).public_url
+
+    def download_public(self, path):
+        # Read without credentials, so GCS itself refuses objects that aren't public
+        from google.api_core.exceptions import Forbidden, NotFound, Unauthorized
+        try:
+            return self.anonymous_bucket.blob(path).download_as_bytes()
+        except (Forbidden, NotFound, Unauthorized):
+            return None
+
+
+class GCSBlobWriter:
+    # Resumable upload session: at most UPLOAD_CHUNK_SIZE is buffered before it is sent
+    def __init__(self, blob, content_type):
+        self.blob = blob
+        self._file = blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type=content_type)
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        # Stays private until the caller publishes it (a deferred job once the record is saved)
+        self._file.close()
+        return self.blob.public_url
+
+    def abort(self):
+        # An unfinished resumable session never creates the object and expires on its own
+        pass
+
+
+class LocalBlobStore(BlobStore):
+    # Also stands in for GCS signed URLs: signed_upload_url points at upload_url, where the
+    # app accepts HMAC-signed PUTs (see check_signed_upload)
+
+    def __init__(self, root, base_url="/blobs", upload_url="/blob-uploads", signing_secret=""):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        self.upload_url = upload_url.rstrip("/")
+        self.signing_secret = signing_secret
+        os.makedirs(self.root, exist_ok=True)
+
+    def _full_path(self, path):
+        full_path = os.path.abspath(os.path.join(self.root, path))
+        if not full_path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid blob path: {path}")
+        return full_path
+
+    def upload(self, path, file_obj, content_type=None):
+        full_path = self._full_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as output:
+            shutil.copyfileobj(file_obj, output)
+        return f"{self.base_url}/{path}"
+
+    def delete(self, path):
+        try:
+            os.remove(self._full_path(path))
+        except FileNotFoundError:
+            pass
+
+    def path_from_url(self, url):
+        prefix = self.base_url + "/"
+        return url[len(prefix):] if url.startswith(prefix) else None
+
+    def probe(self):
+        os.listdir(self.root)
+
+    def _signature(self, path, content_type, expires_at):
+        message = f"PUT\n{path}\n{content_type}\n{expires_at}".encode()
+        return hmac.new(self.signing_secret.encode(), message, hashlib.sha256).hexdigest()
+
+    def signed_upload_url(self, path, content_type, expires):
+        expires_at = int(time.time() + expires)
+        query = urlencode({"expires": expires_at, "signature": self._signature(path, content_type, expires_at)})
+        return f"{self.upload_url}/{quote(path)}?{query}"
+
+    def check_signed_upload(self, path, content_type, expires_at, signature):
+        if not expires_at.isdigit() or int(expires_at) < time.time():
+            return False
+        return hmac.compare_digest(signature, self._signature(path, content_type, int(expires_at)))
+
+    def head(self, path, length):
+        full_path = self._full_path(path)
+        if not os.path.isfile(full_path):
+            return None
+        with open(full_path, "rb") as stored:
+            return os.path.getsize(full_path), stored.read(length)
+
+    def publish(self, path):
+        return self.public_url(path)
+
+    def public_url(self, path):
+        return f"{self.base_url}/{path}"
+
+    def download_public(self, path):
+        # Local files are all public: the app serves the whole directory under base_url
+        full_path = self._full_path(path)
+        if not os.path.isfile(full_path):
+            return None
+        with open(full_path, "rb") as stored:
+            return stored.read()
+
+    def open_writer(self, path, content_type=None):
+        return LocalBlobWriter(self._full_path(path), f"{self.base_url}/{path}")
+
+
+class LocalBlobWriter:
+    # Written to a temporary name and renamed on close, so readers never see a partial file
+    def __init__(self, full_path, url):
+        self.full_path = full_path
+        self.url = url
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        self._temp_path = f"{full_path}.{uuid.uuid4().hex}.part"
+        self._file = open(self._temp_path, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._temp_path, self.full_path)
+        return self.url
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._temp_path)
+
+
+# Instrumentation
+#
+# Wrappers that report every backend call to a list of observers, each called as
+# observer(backend, operation, collection, duration, documents, error, latency).
+# duration is the whole call; latency is the longest single wait on the backend, which
+# for streams and chunked uploads is one batch or chunk rather than the whole transfer.
+
+
+def _admit(admit):
+    # admit() raises to refuse a call before it reaches the backend (an open circuit breaker)
+    if admit is not None:
+        admit()
+
+
+def _notify(observers, backend, operation, collection, duration, documents=0, error=None, latency=None):
+    latency = duration if latency is None else latency
+    for observer in observers:
+        observer(backend, operation, collection, duration, documents, error, latency)
+
+
+class InstrumentedDocumentReference:
+    def __init__(self, reference, collection, observers, read_timeout=None, admit=None):
+        self._reference = reference
+        self._collection = collection
+        self._observers = observers
+        self._read_timeout = read_timeout
+        self._admit = admit
+
+    def __getattr__(self, name):
+        return getattr(self._reference, name)
+
+    def _call(self, operation, method, *args, **kwargs):
+        _admit(self._admit)
+        started = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as err:
+            _notify(self._observers, "firestore", operation, self._collection, time.perf_counter() - started, error=err)
+            raise
+        documents = 1 if operation != "get" or result.exists else 0
+        _notify(self._observers, "firestore", operation, self._collection, time.perf_counter() - started, documents)
+        return result
+
+    def get(self, *args, **kwargs):
+        if self._read_timeout is not None:
+            kwargs.setdefault("timeout", self._read_timeout)
+        return self._call("get", self._reference.get, *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._call("create", self._reference.create, *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._call("set", self._reference.set, *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._call("update", self._reference.update, *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", self._reference.delete, *args, **kwargs)
+
+
+class InstrumentedQuery:
+    def __init__(self, query, collection, observers, read_timeout=None, admit=None):
+        self._query = query
+        self._collection = collection
+        self._observers = observers
+        self._read_timeout = read_timeout
+        self._admit = admit
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def _wrap(self, query):
+        return InstrumentedQuery(query, self._collection, self._observers, self._read_timeout, self._admit)
+
+    def where(self, *args, **kwargs):
+        return self._wrap(self._query.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return self._wrap(self._query.order_by(*args, **kwargs))
+
+    def limit(self, *args, **kwargs):
+        return self._wrap(self._query.limit(*args, **kwargs))
+
+    def start_after(self, *args, **kwargs):
+        return self._wrap(self._query.start_after(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        reference = self._query.document(*args, **kwargs)
+        return InstrumentedDocumentReference(reference, self._collection, self._observers, self._read_timeout,
+                                             self._admit)
+
+    def add(self, *args, **kwargs):
+        _admit(self._admit)
+        started = time.perf_counter()
+        try:
+            result = self._query.add(*args, **kwargs)
+        except Exception as err:
+            _notify(self._observers, "firestore", "add", self._collection, time.perf_counter() - started, error=err)
+            raise
+        _notify(self._observers, "firestore", "add", self._collection, time.perf_counter() - started, 1)
+        return result
+
+    def stream(self, *args, **kwargs):
+        # Only time spent inside the backend iterator is counted, not the caller's loop body.
+        # Each next() that has to fetch a batch is one RPC; the slowest of them is the latency.
+        elapsed = 0.0
+        latency = 0.0
+        documents = 0
+        error = None
+        iterator = iter(())
+        _admit(self._admit)
+        if self._read_timeout is not None:
+            kwargs.setdefault("timeout", self._read_timeout)
+        try:
+            started = time.perf_counter()
+            iterator = iter(self._query.stream(*args, **kwargs))
+            latency = time.perf_counter() - started
+            elapsed += latency
+            while True:
+                started = time.perf_counter()
+                try:
+                    doc = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    waited = time.perf_counter() - started
+                    elapsed += waited
+                    latency = max(latency, waited)
+                documents += 1
+                yield doc
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            _notify(self._observers, "firestore", "stream", self._collection, elapsed, documents, error, latency)
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+
+class InstrumentedWriteBatch:
+    def __init__(self, batch, observers, admit=None):
+        self._batch = batch
+        self._observers = observers
+        self._admit = admit
+        self._writes = 0
+
+    def __getattr__(self, name):
+        return getattr(self._batch, name)
+
+    def _unwrap(self, reference):
+        return reference._reference if isinstance(reference, InstrumentedDocumentReference) else reference
+
+    def create(self, reference, *args, **kwargs):
+        self._writes += 1
+        return self._batch.create(self._unwrap(reference), *args, **kwargs)
+
+    def set(self, reference, *args, **kwargs):
+        self._writes += 1
+        return self._batch.set(self._unwrap(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        self._writes += 1
+        return self._batch.update(self._unwrap(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        self._writes += 1
+        return self._batch.delete(self._unwrap(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        _admit(self._admit)
+        started = time.perf_counter()
+        try:
+            result = self._batch.commit(*args, **kwargs)
+        except Exception as err:
+            _notify(self._observers, "firestore", "commit", "batch", time.perf_counter() - started, error=err)
+            raise
+        _notify(self._observers, "firestore", "commit", "batch", time.perf_counter() - started, self._writes)
+        return result
+
+
+class InstrumentedDocumentStore:
+    # read_timeout is the default deadline (seconds) for get and stream. Writes keep the
+    # client's own deadline: a write that times out on our side may still be applied.
+    # admit, if given, is called before every RPC and may raise to refuse it.
+
+    def __init__(self, client, observers, read_timeout=None, admit=None):
+        self._client = client
+        self._observers = observers
+        self._read_timeout = read_timeout
+        self._admit = admit
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def collection(self, collection_name):
+        return InstrumentedQuery(self._client.collection(collection_name), collection_name, self._observers,
+                                 self._read_timeout, self._admit)
+
+    def batch(self):
+        return InstrumentedWriteBatch(self._client.batch(), self._observers, self._admit)
+
+
+class InstrumentedBlobStore(BlobStore):
+    def __init__(self, store, observers):
+        self._store = store
+        self._observers = observers
+
+    def __getattr__(self, name):
+        return getattr(self._store, name)
+
+    def _call(self, operation, path, method, *args):
+        started = time.perf_counter()
+        collection = path.split("/", 1)[0]
+        try:
+            result = method(path, *args)
+        except Exception as err:
+            _notify(self._observers, "storage", operation, collection, time.perf_counter() - started, error=err)
+            raise
+        _notify(self._observers, "storage", operation, collection, time.perf_counter() - started, 1)
+        return result
+
+    def upload(self, path, file_obj, content_type=None):
+        return self._call("upload", path, self._store.upload, file_obj, content_type)
+
+    def delete(self, path):
+        return self._call("delete", path, self._store.delete)
+
+    def open_writer(self, path, content_type=None):
+        return InstrumentedBlobWriter(self._store.open_writer(path, content_type), path, self._observers)
+
+    def signed_upload_url(self, path, content_type, expires):
+        return self._store.signed_upload_url(path, content_type, expires)
+
+    def head(self, path, length):
+        return self._call("head", path, self._store.head, length)
+
+    def publish(self, path):
+        return self._call("publish", path, self._store.publish)
+
+    def public_url(self, path):
+        return self._store.public_url(path)
+
+    def download_public(self, path):
+        return self._call("download", path, self._store.download_public)
+
+    def path_from_url(self, url):
+        return self._store.path_from_url(url)
+
+
+class InstrumentedBlobWriter:
+    # Reported as one "upload" call covering the time spent in write and close; each
+    # write or close sends at most one chunk, so the slowest of them is the latency
+    def __init__(self, writer, path, observers):
+        self._writer = writer
+        self._collection = path.split("/", 1)[0]
+        self._observers = observers
+        self._elapsed = 0.0
+        self._latency = 0.0
+
+    def _call(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        except Exception as err:
+            waited = time.perf_counter() - started
+            _notify(self._observers, "storage", "upload", self._collection, self._elapsed + waited, error=err,
+                    latency=max(self._latency, waited))
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self._elapsed += waited
+            self._latency = max(self._latency, waited)
+
+    def write(self, data):
+        self._call(self._writer.write, data)
+
+    def close(self):
+        url = self._call(self._writer.close)
+        _notify(self._observers, "storage", "upload", self._collection, self._elapsed, 1, latency=self._latency)
+        return url
+
+    def abort(self):
+        self._writer.abort()
+
+
+def create_if_absent(reference, data):
+    """Create the document; return False instead of raising if it already exists."""
+    try:
+        reference.create(data)
+    except AlreadyExists:
+        return False
+    except Exception as err:
+        from google.api_core.exceptions import Conflict
+        if isinstance(err, Conflict):
+            return False
+        raise
+    return True
+
+
+def create_document_store():
+    if local_constants.BACKEND == "memory":
+        return MemoryDocumentStore()
+    from google.cloud import firestore
+    return firestore.Client()
+
+
+def create_blob_store():
+    if local_constants.BLOB_STORE == "local":
+        return LocalBlobStore(local_constants.LOCAL_BLOB_DIR, signing_secret=local_constants.UPLOAD_SIGNING_SECRET)
+    return GCSBlobStore(local_constants.PROJECT_NAME, local_constants.PROJECT_STORAGE_BUCKET)
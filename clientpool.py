@@ -0,0 +1,69 @@
+import contextvars
+import itertools
+import threading
+
+import backends
+import metrics
+
+
+class ClientPool:
+    # Several clients, each with its own gRPC channel, so concurrent requests aren't all
+    # multiplexed over one connection. A request is pinned to one client for its whole
+    # lifetime (ClientPoolMiddleware); calls made outside a request rotate per call.
+
+    def __init__(self, factory, size, name="firestore"):
+        self.name = name
+        self.clients = [backends.LazyClient(factory) for _ in range(max(1, size))]
+        self.in_flight = [0] * len(self.clients)
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._pinned = contextvars.ContextVar(f"{name}_pool_client", default=None)
+
+    def _pick(self):
+        return next(self._next) % len(self.clients)
+
+    def acquire(self):
+        index = self._pick()
+        with self._lock:
+            self.in_flight[index] += 1
+        metrics.POOL_IN_FLIGHT.labels(self.name, str(index)).inc()
+        metrics.POOL_ACQUIRED.labels(self.name, str(index)).inc()
+        return index, self._pinned.set(index)
+
+    def release(self, index, token):
+        self._pinned.reset(token)
+        with self._lock:
+            self.in_flight[index] -= 1
+        metrics.POOL_IN_FLIGHT.labels(self.name, str(index)).dec()
+
+    def current(self):
+        index = self._pinned.get()
+        return self.clients[self._pick() if index is None else index]
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+    def warm_up(self, index, probe):
+        # Building the client and issuing one cheap call opens the channel and fetches
+        # credentials, so the first real requests don't pay for it
+        probe(self.clients[index].get())
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self.clients), "in_flight": list(self.in_flight)}
+
+
+class ClientPoolMiddleware:
+    def __init__(self, app, pool):
+        self.app = app
+        self.pool = pool
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        index, token = self.pool.acquire()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.pool.release(index, token)
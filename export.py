@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+import sys
+
+DRIVER_FIELDS = ["id", "name", "age", "total_pole_positions", "total_race_wins", "total_points_scored",
+                 "total_world_titles", "total_fastest_laps", "team", "image_url"]
+TEAM_FIELDS = ["id", "name", "year_founded", "total_pole_positions", "total_race_wins",
+               "total_constructor_titles", "finishing_position_previous_season", "logo_url"]
+EXPORT_FIELDS = {"drivers": DRIVER_FIELDS, "teams": TEAM_FIELDS}
+NUMERIC_FIELDS = {
+    "age", "total_pole_positions", "total_race_wins", "total_points_scored", "total_world_titles",
+    "total_fastest_laps", "year_founded", "total_constructor_titles", "finishing_position_previous_season",
+}
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+PAGE_SIZE = 500
+
+
+def iter_pages(collection_ref, page_size=PAGE_SIZE):
+    # Keyset pagination on the document id, so only one page of snapshots is held at a time
+    query = collection_ref.order_by("__name__").limit(page_size)
+    last_doc = None
+    while True:
+        page = query.start_after(last_doc) if last_doc is not None else query
+        docs = list(page.stream())
+        if docs:
+            yield [doc.to_dict() | {"id": doc.id} for doc in docs]
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+
+def iter_csv(pages, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for page in pages:
+        writer.writerows(page)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_ndjson(pages, fields):
+    for page in pages:
+        lines = [json.dumps({field: record.get(field) for field in fields}) for record in page]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def stream_export(collection_ref, collection, fmt, page_size=PAGE_SIZE):
+    fields = EXPORT_FIELDS[collection]
+    pages = iter_pages(collection_ref, page_size)
+    if fmt == "csv":
+        return iter_csv(pages, fields)
+    if fmt == "ndjson":
+        return iter_ndjson(pages, fields)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def write_parquet(collection_ref, collection, path, page_size=PAGE_SIZE):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as err:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)") from err
+
+    fields = EXPORT_FIELDS[collection]
+    schema = pa.schema([(field, pa.int64() if field in NUMERIC_FIELDS else pa.string()) for field in fields])
+    rows = 0
+    # One row group per page keeps the writer's memory bounded by the page size
+    with pq.ParquetWriter(path, schema) as writer:
+        for page in iter_pages(collection_ref, page_size):
+            columns = {field: [record.get(field) for record in page] for field in fields}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            rows += len(page)
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in EXPORT_FIELDS:
+        print("Usage: python export.py <drivers|teams> <output.parquet|output.csv|output.ndjson>")
+        sys.exit(1)
+
+    import backends
+
+    collection, output_path = sys.argv[1], sys.argv[2]
+    collection_ref = backends.create_document_store().collection(collection)
+    if output_path.endswith(".parquet"):
+        count = write_parquet(collection_ref, collection, output_path)
+        print(f"Wrote {count} {collection} to {output_path}")
+    else:
+        fmt = output_path.rsplit(".", 1)[-1]
+        with open(output_path, "wb") as output:
+            for chunk in stream_export(collection_ref, collection, fmt):
+                output.write(chunk)
+        print(f"Wrote {collection} to {output_path}")
@@ -0,0 +1,13 @@
+import asyncio
+
+from starlette.concurrency import run_in_threadpool
+
+import profiling
+
+
+async def gather(*calls):
+    # Independent blocking backend calls run side by side in the threadpool, so a page
+    # waits for its slowest round trip instead of the sum of them. Results come back in
+    # call order; the request's contextvars (cost accounting, profiler) are copied into
+    # each worker thread.
+    return await asyncio.gather(*(run_in_threadpool(profiling.sampled, call) for call in calls))
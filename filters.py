@@ -0,0 +1,303 @@
+import functools
+import operator
+import re
+
+import export
+import metrics
+import records
+
+# Fields a query may name, with their type taken from the export schema
+QUERY_FIELDS = {
+    collection: [field for field in fields if field not in ("id", "image_url", "logo_url")]
+    for collection, fields in export.EXPORT_FIELDS.items()
+}
+COMPARISONS = {
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+INEQUALITIES = {"!=", "<", "<=", ">", ">="}
+MAX_LENGTH = 500
+MAX_DEPTH = 16
+# Firestore limits for a single query: disjunctions after expanding `or` and `in`, and
+# values in one `in` list
+MAX_DISJUNCTIONS = 30
+MAX_IN_VALUES = 30
+# Firestore stores integers as signed 64-bit
+MAX_INTEGER = 2 ** 63 - 1
+ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<op>==|!=|<=|>=|<|>)
+  | (?P<punct>[(),\[\]])
+  | (?P<name>[A-Za-z_]\w*)
+)""", re.VERBOSE)
+
+
+class FilterError(Exception):
+    pass
+
+
+class Comparison:
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def disjunctions(self):
+        return len(self.value) if self.op == "in" else 1
+
+    def conjuncts(self):
+        return [[self]]
+
+    def firestore_filter(self, firestore):
+        return firestore.FieldFilter(self.field, self.op, list(self.value) if self.op == "in" else self.value)
+
+    def mask(self, table):
+        import numpy as np
+        column = table.column(self.field)
+        categories = table.categories.get(self.field)
+        if categories is not None:
+            # Compare each distinct value once, then match rows by code
+            codes = [code for code, value in enumerate(categories) if _matches(self.op, value, self.value)]
+            return np.isin(column, codes)
+        if isinstance(column, np.ndarray):
+            matched = np.isin(column, self.value) if self.op == "in" else COMPARISONS[self.op](column, self.value)
+            # Gaps are stored as 0; drop them like Firestore drops documents without the field
+            present = table.present(self.field)
+            return matched if present is None else matched & present
+        return np.fromiter((_matches(self.op, value, self.value) for value in column), bool, len(column))
+
+    def __repr__(self):
+        return f"{self.field} {self.op} {self.value!r}"
+
+
+class Composite:
+    def __init__(self, op, operands):
+        self.op = op
+        self.operands = operands
+
+    def disjunctions(self):
+        counts = [operand.disjunctions() for operand in self.operands]
+        return sum(counts) if self.op == "or" else functools.reduce(operator.mul, counts)
+
+    def conjuncts(self):
+        # Disjunctive normal form; only called once disjunctions() is known to be small
+        if self.op == "or":
+            return [conjunct for operand in self.operands for conjunct in operand.conjuncts()]
+        result = [[]]
+        for operand in self.operands:
+            result = [left + right for left in result for right in operand.conjuncts()]
+        return result
+
+    def firestore_filter(self, firestore):
+        filters = [operand.firestore_filter(firestore) for operand in self.operands]
+        return firestore.Or(filters) if self.op == "or" else firestore.And(filters)
+
+    def mask(self, table):
+        import numpy as np
+        masks = [operand.mask(table) for operand in self.operands]
+        return (np.logical_or if self.op == "or" else np.logical_and).reduce(masks)
+
+    def __repr__(self):
+        return "(" + f" {self.op} ".join(map(repr, self.operands)) + ")"
+
+
+class FilterExpression:
+    # A parsed, validated filter. `pushdown` says whether Firestore can run it as a single
+    # query using only its automatic single-field indexes; every expression can also be
+    # evaluated in memory against a ColumnTable.
+
+    def __init__(self, collection, text, tree):
+        self.collection = collection
+        self.text = text
+        self.tree = tree
+        self.pushdown = _can_push_down(tree)
+        self._firestore_filter = None
+
+    def firestore_filter(self):
+        if self._firestore_filter is None:
+            # Imported on first use, like the rest of the Google client stack
+            from google.cloud.firestore_v1 import base_query
+            self._firestore_filter = self.tree.firestore_filter(base_query)
+        return self._firestore_filter
+
+    def select(self, table):
+        """Return the table's rows matching the expression, as Records."""
+        return table.select(self.tree.mask(table)) if len(table) else []
+
+    def __repr__(self):
+        return f"FilterExpression({self.collection}: {self.tree!r})"
+
+
+def _matches(op, field_value, value):
+    # Firestore skips documents without the field, and a null only matches == null
+    if field_value is None or field_value is records.ABSENT:
+        return False
+    if op == "in":
+        return field_value in value
+    try:
+        return COMPARISONS[op](field_value, value)
+    except TypeError:
+        # Like Firestore, values of different types never match
+        return False
+
+
+def _can_push_down(tree):
+    # Firestore (as of this client) allows inequality filters on one field only, and an
+    # equality filter on another field next to a range needs a composite index
+    if tree.disjunctions() > MAX_DISJUNCTIONS:
+        return False
+    inequality_fields = set()
+    for conjunct in tree.conjuncts():
+        fields = {comparison.field for comparison in conjunct}
+        ranged = {comparison.field for comparison in conjunct if comparison.op in INEQUALITIES}
+        if ranged and len(fields) > 1:
+            return False
+        inequality_fields |= ranged
+    return len(inequality_fields) <= 1
+
+
+class _Parser:
+    # Grammar, loosest binding first:
+    #   expression := conjunction ("or" conjunction)*
+    #   conjunction := term ("and" term)*
+    #   term := "(" expression ")" | field OP literal | field "in" "[" literal ("," literal)* "]"
+
+    def __init__(self, collection, text):
+        self.collection = collection
+        self.fields = QUERY_FIELDS[collection]
+        self.tokens = _tokenize(text)
+        self.position = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, value):
+        kind, found = self.next()
+        if found != value:
+            raise FilterError(f"Expected {value!r} but found {_describe(kind, found)}")
+
+    def keyword(self, word):
+        kind, value = self.peek()
+        if kind == "name" and value.lower() == word:
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        tree = self.expression()
+        kind, value = self.peek()
+        if kind is not None:
+            raise FilterError(f"Unexpected {_describe(kind, value)}")
+        return tree
+
+    def expression(self):
+        operands = [self.conjunction()]
+        while self.keyword("or"):
+            operands.append(self.conjunction())
+        return operands[0] if len(operands) == 1 else Composite("or", operands)
+
+    def conjunction(self):
+        operands = [self.term()]
+        while self.keyword("and"):
+            operands.append(self.term())
+        return operands[0] if len(operands) == 1 else Composite("and", operands)
+
+    def term(self):
+        kind, value = self.peek()
+        if value == "(":
+            self.depth += 1
+            if self.depth > MAX_DEPTH:
+                raise FilterError("Expression is nested too deeply")
+            self.position += 1
+            tree = self.expression()
+            self.expect(")")
+            self.depth -= 1
+            return tree
+        if kind != "name" or value.lower() in ("and", "or", "in"):
+            raise FilterError(f"Expected a field name but found {_describe(kind, value)}")
+        self.position += 1
+        if value not in self.fields:
+            raise FilterError(f"Unknown field {value}; {self.collection} can be filtered on {', '.join(self.fields)}")
+        field = value
+        if self.keyword("in"):
+            self.expect("[")
+            values = [self.literal(field)]
+            while self.peek()[1] == ",":
+                self.position += 1
+                values.append(self.literal(field))
+            self.expect("]")
+            if len(values) > MAX_IN_VALUES:
+                raise FilterError(f"An in list can hold at most {MAX_IN_VALUES} values")
+            return Comparison(field, "in", tuple(dict.fromkeys(values)))
+        kind, op = self.next()
+        if kind != "op":
+            raise FilterError(f"Expected a comparison after {field} but found {_describe(kind, op)}")
+        return Comparison(field, op, self.literal(field))
+
+    def literal(self, field):
+        kind, value = self.next()
+        if field in export.NUMERIC_FIELDS:
+            if kind != "number":
+                raise FilterError(f"{field} is numeric; expected a number but found {_describe(kind, value)}")
+            number = float(value) if "." in value else int(value)
+            if abs(number) > MAX_INTEGER:
+                raise FilterError(f"{value} is out of range for {field}")
+            return number
+        if kind != "string":
+            raise FilterError(f"{field} is text; expected a quoted string but found {_describe(kind, value)}")
+        return _unquote(value)
+
+
+def _unquote(literal):
+    # Only quotes and backslashes can be escaped; anything else is almost certainly a typo
+    def unescape(match):
+        if match.group(1) not in "\\\"'":
+            raise FilterError(f"Unsupported escape \\{match.group(1)} in {literal}")
+        return match.group(1)
+    return ESCAPE.sub(unescape, literal[1:-1])
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise FilterError(f"Unexpected character {text[position:].lstrip()[:1]!r} at position {position}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+def _describe(kind, value):
+    return "the end of the expression" if kind is None else repr(value)
+
+
+def compile_expression(collection, text):
+    """Parse and validate `text` against the collection's fields; repeat queries reuse the result."""
+    hits = _compile.cache_info().hits
+    expression = _compile(collection, text)
+    info = _compile.cache_info()
+    metrics.record_cache("filters", info.hits > hits)
+    metrics.set_cache_size("filters", info.currsize)
+    return expression
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(collection, text):
+    if collection not in QUERY_FIELDS:
+        raise FilterError(f"Unknown collection {collection}")
+    if not text.strip():
+        raise FilterError("Enter a filter expression")
+    if len(text) > MAX_LENGTH:
+        raise FilterError(f"Expressions are limited to {MAX_LENGTH} characters")
+    return FilterExpression(collection, text, _Parser(collection, text).parse())
@@ -0,0 +1,47 @@
+import asyncio
+import functools
+import time
+
+import fanout
+
+
+class HealthChecker:
+    # Runs every probe concurrently and keeps the outcome for `ttl` seconds, so load
+    # balancer checks don't turn into a steady stream of backend calls
+
+    def __init__(self, probes, latency_threshold, ttl):
+        self.probes = probes
+        self.latency_threshold = latency_threshold
+        self.ttl = ttl
+        self.result = None
+        self._checked = None
+        self._lock = None
+
+    def _run(self, name):
+        started = time.perf_counter()
+        try:
+            self.probes[name]()
+            error = None
+        except Exception as err:
+            error = f"{type(err).__name__}: {err}"
+        latency = time.perf_counter() - started
+        ok = error is None and latency <= self.latency_threshold
+        return name, {"ok": ok, "latency_ms": round(latency * 1000, 1), "error": error}
+
+    async def check(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Concurrent readiness checks share a single run
+        async with self._lock:
+            if self._checked is not None and time.monotonic() - self._checked < self.ttl:
+                return self.result
+            outcomes = await fanout.gather(*(functools.partial(self._run, name) for name in self.probes))
+            checks = dict(outcomes)
+            self.result = {
+                "ready": all(check["ok"] for check in checks.values()),
+                "checked_at": time.time(),
+                "latency_threshold_ms": self.latency_threshold * 1000,
+                "checks": checks,
+            }
+            self._checked = time.monotonic()
+            return self.result
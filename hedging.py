@@ -0,0 +1,98 @@
+import collections
+import concurrent.futures
+import contextvars
+import threading
+import time
+
+import metrics
+
+
+class LatencyWindow:
+    # Recent latencies for one kind of read; the percentile is recomputed every
+    # `refresh` samples rather than on every call
+    def __init__(self, size=1000, refresh=50):
+        self.samples = collections.deque(maxlen=size)
+        self.refresh = refresh
+        self._since_refresh = 0
+        self._cached = {}
+        self._lock = threading.Lock()
+
+    def add(self, duration):
+        with self._lock:
+            self.samples.append(duration)
+            self._since_refresh += 1
+            if self._since_refresh >= self.refresh:
+                self._since_refresh = 0
+                self._cached = {}
+
+    def percentile(self, percentile, min_samples):
+        with self._lock:
+            if len(self.samples) < min_samples:
+                return None
+            if percentile not in self._cached:
+                ordered = sorted(self.samples)
+                self._cached[percentile] = ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+            return self._cached[percentile]
+
+
+class HedgedReader:
+    # If a read hasn't finished within the observed percentile latency, send a duplicate
+    # and use whichever answers first. Every read earns `max_rate` of a hedge, so at
+    # most that fraction of reads are duplicated even when the backend slows down.
+
+    def __init__(self, percentile, max_rate, workers, min_samples=20, burst=10):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.burst = burst
+        self.windows = collections.defaultdict(LatencyWindow)
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="hedged-read")
+
+    def _submit(self, key, call):
+        # Each attempt gets its own copy of the request context (accounting, pinned client)
+        started = time.perf_counter()
+        future = self._executor.submit(contextvars.copy_context().run, call)
+        future.add_done_callback(lambda _: self.windows[key].add(time.perf_counter() - started))
+        return future
+
+    def _take_token(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def _earn_token(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.max_rate)
+
+    def read(self, key, call):
+        self._earn_token()
+        delay = self.windows[key].percentile(self.percentile, self.min_samples)
+        primary = self._submit(key, call)
+        if delay is None:
+            return primary.result()
+        try:
+            return primary.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        if not self._take_token():
+            metrics.HEDGED_READS.labels(key, "skipped").inc()
+            return primary.result()
+
+        metrics.HEDGED_READS.labels(key, "issued").inc()
+        hedge = self._submit(key, call)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    metrics.HEDGED_READS.labels(key, "won" if future is hedge else "lost").inc()
+                    return future.result()
+        # Both attempts failed: report the original error
+        return primary.result()
+
+    def reader(self, key, call):
+        return lambda: self.read(key, call)
@@ -0,0 +1,264 @@
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import warnings
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+# Requested widths are rounded up to one of these, so the cache holds a few variants
+# per image instead of one per pixel width
+WIDTHS = (160, 320, 480, 640, 960, 1280, 1920)
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Larger images are refused before decoding: a small, highly compressed upload can
+# otherwise expand to gigabytes in the resize worker
+MAX_PIXELS = 50_000_000
+
+
+class ImageError(Exception):
+    # Raised for files Pillow can't decode or won't open; plain, so it pickles back
+    # from the resize process
+    pass
+
+
+def snap_width(width):
+    for allowed in WIDTHS:
+        if width <= allowed:
+            return allowed
+    return WIDTHS[-1]
+
+
+def resize_image(data, width, fmt):
+    # Runs in a worker process; Pillow is imported there only
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            return _resize(data, width, fmt)
+    except (OSError, Image.DecompressionBombError, Image.DecompressionBombWarning) as err:
+        raise ImageError(f"{type(err).__name__}: {err}") from None
+
+
+def _resize(data, width, fmt):
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image.thumbnail((width, image.height * width // image.width + 1), Image.LANCZOS)
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        output = io.BytesIO()
+        image.save(output, fmt.upper(), quality=82, optimize=True)
+        return output.getvalue()
+
+
+class DiskCache:
+    # Files named by a hash of their key, evicted least recently used once their total
+    # size passes max_bytes. The index is per process; a file another worker evicted
+    # is simply a miss.
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        existing = []
+        for name in os.listdir(directory):
+            if name.endswith(".part"):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            existing.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._entries[name] = size
+            self.total_bytes += size
+        self.report_size()
+
+    def report_size(self):
+        metrics.set_cache_size("images", len(self._entries))
+
+    @staticmethod
+    def name(key):
+        return hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        if not os.path.exists(self.path(name)):
+            self.forget(name)
+            return None
+        return self.path(name)
+
+    def put(self, name, data):
+        temp_path = f"{self.path(name)}.{uuid.uuid4().hex}.part"
+        with open(temp_path, "wb") as output:
+            output.write(data)
+        os.replace(temp_path, self.path(name))
+        evicted = []
+        with self._lock:
+            self.total_bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_name, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+                evicted.append(old_name)
+            self.report_size()
+        for old_name in evicted:
+            try:
+                os.remove(self.path(old_name))
+            except FileNotFoundError:
+                pass
+        return self.path(name)
+
+    def forget(self, name):
+        with self._lock:
+            self.total_bytes -= self._entries.pop(name, 0)
+            self.report_size()
+
+
+class ImageProxy:
+    # Serves resized, transcoded copies of stored images. Each original is downloaded
+    # once and cached next to its variants; concurrent misses for the same variant share
+    # one resize, which runs in a process pool so it never holds the event loop or GIL.
+
+    def __init__(self, blob_store, cache, workers):
+        self.blob_store = blob_store
+        self.cache = cache
+        self.workers = workers
+        self._pool = None
+        self._pool_pid = None
+        self._in_flight = {}
+
+    def _executor(self):
+        # Created on first use in each worker process, never inherited across a fork
+        if self._pool_pid != os.getpid():
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def close(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def _once(self, name, produce):
+        path = self.cache.get(name)
+        metrics.record_cache("images", path is not None)
+        if path is not None:
+            return path
+        if name not in self._in_flight:
+            self._in_flight[name] = asyncio.ensure_future(produce())
+            self._in_flight[name].add_done_callback(lambda _: self._in_flight.pop(name, None))
+        return await asyncio.shield(self._in_flight[name])
+
+    async def _read(self, name, produce):
+        # The file can be evicted (by this or another worker) between lookup and read;
+        # it is then produced once more
+        path = await self._once(name, produce)
+        try:
+            return await run_in_threadpool(read_file, path)
+        except FileNotFoundError:
+            self.cache.forget(name)
+        return await run_in_threadpool(read_file, await self._once(name, produce))
+
+    async def _original(self, path):
+        name = self.cache.name(("original", path))
+
+        async def download():
+            # Only published files: private uploads must not leak through the proxy
+            data = await run_in_threadpool(self.blob_store.download_public, path)
+            if data is None:
+                raise FileNotFoundError(path)
+            return await run_in_threadpool(self.cache.put, name, data)
+
+        return await self._read(name, download)
+
+    def etag(self, path, width, fmt):
+        # Stored paths are never overwritten, so a variant's name identifies its bytes
+        return f'"{self.cache.name((path, width, fmt))}"'
+
+    async def variant(self, path, width, fmt):
+        """Return the bytes of `path` resized to `width` in `fmt`."""
+        name = self.cache.name((path, width, fmt))
+
+        async def resize():
+            data = await self._original(path)
+            started = time.perf_counter()
+            resized = await asyncio.get_running_loop().run_in_executor(
+                self._executor(), resize_image, data, width, fmt)
+            metrics.IMAGE_RESIZE_SECONDS.labels(fmt).observe(time.perf_counter() - started)
+            return await run_in_threadpool(self.cache.put, name, resized)
+
+        return await self._read(name, resize)
+
+
+
+class ReferencedPaths:
+    # Paths `lookup` recently confirmed a record points at, remembered for `ttl` seconds
+    # so most requests skip the lookup. Refusals aren't remembered: a new record's image
+    # has to be servable at once.
+
+    def __init__(self, lookup, ttl, max_entries=10000):
+        self.lookup = lookup
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._confirmed = collections.OrderedDict()
+
+    async def check(self, path):
+        confirmed_at = self._confirmed.get(path)
+        hit = confirmed_at is not None and time.monotonic() - confirmed_at < self.ttl
+        metrics.record_cache("image_references", hit)
+        if hit:
+            return True
+        if not await run_in_threadpool(self.lookup, path):
+            return False
+        self._confirmed[path] = time.monotonic()
+        self._confirmed.move_to_end(path)
+        while len(self._confirmed) > self.max_entries:
+            self._confirmed.popitem(last=False)
+        metrics.set_cache_size("image_references", len(self._confirmed))
+        return True
+
+
+def read_file(path):
+    with open(path, "rb") as stored:
+        return stored.read()
+
+
+def parse_range(header, size):
+    # Single "bytes=start-end" ranges only; returns (start, end) inclusive, or None if unsatisfiable
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if start:
+            start, end = int(start), int(end) if end else size - 1
+        else:
+            start, end = max(0, size - int(end)), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, min(end, size - 1)
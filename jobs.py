@@ -0,0 +1,220 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    locked_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, run_at);
+"""
+
+
+class JobQueue:
+    # Durable queue in a local SQLite file, shared by every worker process on the host.
+    # A claimed job is hidden for `visibility_timeout` seconds; if its worker dies before
+    # finishing, it becomes due again. Failed attempts are retried with exponential
+    # backoff up to `max_attempts`, so handlers must be safe to run more than once.
+    # Enqueueing the same idempotency key again is a no-op while the first job is kept.
+
+    def __init__(self, path, max_attempts=5, visibility_timeout=60, backoff=1.0, max_backoff=300, retention=86400):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retention = retention
+        self.handlers = {}
+        self._loop = None
+        self._wake = None
+        self._tasks = []
+        self._purged_at = 0
+        self._schema_lock = threading.Lock()
+        self._schema_pid = None
+
+    def handler(self, kind):
+        def register(function):
+            self.handlers[kind] = function
+            return function
+        return register
+
+    def _connect(self):
+        # A connection per operation: cheap for SQLite, and safe across threads and forks
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        # With WAL, NORMAL survives a process crash and skips an fsync per enqueue
+        connection.execute("PRAGMA synchronous=NORMAL")
+        if self._schema_pid != os.getpid():
+            with self._schema_lock:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(SCHEMA)
+                self._schema_pid = os.getpid()
+        return connection
+
+    def enqueue(self, kind, payload, key=None):
+        """Queue kind(payload); returns False if a job with the same key already exists."""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for job kind {kind}")
+        key = key or f"{kind}:{json.dumps(payload, sort_keys=True)}"
+        now = time.time()
+        connection = self._connect()
+        try:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO jobs (kind, payload, idempotency_key, run_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), key, now, now),
+            )
+        finally:
+            connection.close()
+        added = cursor.rowcount == 1
+        metrics.JOBS.labels(kind, "enqueued" if added else "duplicate").inc()
+        if added and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return added
+
+    def claim(self):
+        now = time.time()
+        connection = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so two workers can't claim one job
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT id, kind, payload, attempts, created_at FROM jobs"
+                " WHERE status = ? AND run_at <= ? AND (locked_until IS NULL OR locked_until <= ?)"
+                " ORDER BY run_at LIMIT 1",
+                (PENDING, now, now),
+            ).fetchone()
+            if row is not None:
+                connection.execute("UPDATE jobs SET attempts = attempts + 1, locked_until = ? WHERE id = ?",
+                                   (now + self.visibility_timeout, row[0]))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        job_id, kind, payload, attempts, created_at = row
+        return {"id": job_id, "kind": kind, "payload": json.loads(payload), "attempt": attempts + 1,
+                "created_at": created_at}
+
+    def complete(self, job):
+        self._execute("UPDATE jobs SET status = ?, locked_until = NULL, finished_at = ? WHERE id = ?",
+                      (DONE, time.time(), job["id"]))
+        metrics.JOBS.labels(job["kind"], "succeeded").inc()
+        metrics.JOB_LAG.labels(job["kind"]).observe(time.time() - job["created_at"])
+
+    def fail(self, job, error):
+        if job["attempt"] >= self.max_attempts:
+            self._execute("UPDATE jobs SET status = ?, locked_until = NULL, last_error = ?, finished_at = ? WHERE id = ?",
+                          (FAILED, error, time.time(), job["id"]))
+            metrics.JOBS.labels(job["kind"], "failed").inc()
+            return
+        # Full jitter keeps retries from many workers from lining up
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (job["attempt"] - 1)))
+        self._execute("UPDATE jobs SET run_at = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+                      (time.time() + delay, error, job["id"]))
+        metrics.JOBS.labels(job["kind"], "retried").inc()
+
+    def purge(self):
+        # Finished jobs are kept for `retention` seconds so repeated keys stay no-ops
+        self._execute("DELETE FROM jobs WHERE status != ? AND finished_at < ?", (PENDING, time.time() - self.retention))
+
+    def _execute(self, sql, params):
+        connection = self._connect()
+        try:
+            connection.execute(sql, params)
+        finally:
+            connection.close()
+
+    def probe(self):
+        self._execute("SELECT 1", ())
+
+    def stats(self, failures=20):
+        connection = self._connect()
+        try:
+            counts = dict(connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            due = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND run_at <= ?",
+                                     (PENDING, time.time())).fetchone()[0]
+            failed = connection.execute(
+                "SELECT id, kind, payload, attempts, last_error, finished_at FROM jobs WHERE status = ?"
+                " ORDER BY finished_at DESC LIMIT ?", (FAILED, failures)).fetchall()
+        finally:
+            connection.close()
+        return {
+            "counts": {status: counts.get(status, 0) for status in (PENDING, DONE, FAILED)},
+            "due": due,
+            "failed": [dict(zip(("id", "kind", "payload", "attempts", "last_error", "finished_at"), row))
+                       for row in failed],
+        }
+
+    async def _run(self, job):
+        try:
+            await run_in_threadpool(self.handlers[job["kind"]], **job["payload"])
+        except Exception as err:
+            print(f"Job {job['kind']} #{job['id']} attempt {job['attempt']} failed: {err}")
+            outcome = (self.fail, job, f"{type(err).__name__}: {err}")
+        else:
+            outcome = (self.complete, job)
+        try:
+            await run_in_threadpool(*outcome)
+        except sqlite3.Error as err:
+            # The job stays claimed and runs again once its visibility timeout passes
+            print(f"Could not record the result of job {job['kind']} #{job['id']}: {err}")
+
+    async def _work(self, poll_interval):
+        while True:
+            self._wake.clear()
+            try:
+                job = await run_in_threadpool(self.claim)
+            except sqlite3.Error as err:
+                print(f"Job queue unavailable: {err}")
+                job = None
+            if job is not None:
+                await self._run(job)
+                continue
+            if time.time() - self._purged_at > 3600:
+                self._purged_at = time.time()
+                try:
+                    await run_in_threadpool(self.purge)
+                except sqlite3.Error as err:
+                    print(f"Job queue purge failed: {err}")
+            # Sleep until the poll interval passes or this process enqueues something;
+            # jobs queued by other processes are picked up on the next poll
+            try:
+                await asyncio.wait_for(self._wake.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, workers, poll_interval):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._tasks = [self._loop.create_task(self._work(poll_interval)) for _ in range(workers)]
+
+    async def stop(self):
+        # A job interrupted here is retried by any worker once its visibility timeout passes
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._loop = None
@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import httpx
+
+DEFAULT_MIX = "home=1,drivers=3,driver_details=4,query_drivers=2,compare_drivers=1"
+DRIVER_QUERIES = [
+    "age < 26",
+    "total_race_wins > 5",
+    "total_world_titles == 0",
+    'team == "Ferrari"',
+    'team == "Ferrari" and total_race_wins > 5 or age < 25',
+]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown route in mix: {name} (choose from {', '.join(SCENARIOS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def home(client, driver_ids):
+    return await client.get("/")
+
+
+async def drivers(client, driver_ids):
+    return await client.get("/drivers")
+
+
+async def driver_details(client, driver_ids):
+    return await client.get(f"/drivers/{random.choice(driver_ids)}")
+
+
+async def query_drivers(client, driver_ids):
+    return await client.post("/drivers/query", data={"expression": random.choice(DRIVER_QUERIES)})
+
+
+async def compare_drivers(client, driver_ids):
+    driver1_id, driver2_id = random.sample(driver_ids, 2)
+    return await client.post("/compare/drivers", data={"driver1_id": driver1_id, "driver2_id": driver2_id})
+
+
+SCENARIOS = {
+    "home": home,
+    "drivers": drivers,
+    "driver_details": driver_details,
+    "query_drivers": query_drivers,
+    "compare_drivers": compare_drivers,
+}
+
+
+async def discover_driver_ids(client):
+    response = await client.get("/export/drivers", params={"format": "ndjson"})
+    response.raise_for_status()
+    ids = [json.loads(line)["id"] for line in response.text.splitlines() if line]
+    if len(ids) < 2:
+        raise SystemExit("Load test needs at least two drivers; seed the database first.")
+    return ids
+
+
+async def worker(client, weights, driver_ids, deadline, samples, errors):
+    names = list(weights)
+    route_weights = list(weights.values())
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights=route_weights)[0]
+        started = time.perf_counter()
+        try:
+            response = await SCENARIOS[name](client, driver_ids)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        samples[name].append(time.perf_counter() - started)
+        if failed:
+            errors[name] += 1
+
+
+def summarize(samples, errors, elapsed):
+    routes = {}
+    for name, latencies in samples.items():
+        latencies.sort()
+        routes[name] = {
+            "requests": len(latencies),
+            "errors": errors[name],
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    all_latencies = sorted(latency for latencies in samples.values() for latency in latencies)
+    total = {
+        "requests": len(all_latencies),
+        "errors": sum(errors.values()),
+        "rps": round(len(all_latencies) / elapsed, 2),
+        "p50_ms": round(percentile(all_latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(all_latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(all_latencies, 0.99) * 1000, 2),
+    }
+    return routes, total
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    regressions = []
+    for name, current in list(report["routes"].items()) + [("total", report["total"])]:
+        previous = baseline["total"] if name == "total" else baseline.get("routes", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {previous[metric]} -> {current[metric]}")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name} rps: {previous['rps']} -> {current['rps']}")
+    return regressions
+
+
+def install_fake_verifier(user_id="loadtest-user", email="loadtest@example.com"):
+    import google.oauth2.id_token
+
+    def verify_firebase_token(id_token, request, audience=None, clock_skew_in_seconds=0):
+        if id_token != "loadtest-token":
+            raise ValueError("Unexpected load test token")
+        return {"user_id": user_id, "email": email}
+
+    google.oauth2.id_token.verify_firebase_token = verify_firebase_token
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    cookies = {"token": args.token} if args.token else {}
+    if args.in_process:
+        if args.token:
+            install_fake_verifier()
+        import main as app_module
+        await app_module.app.router.startup()
+        transport = httpx.ASGITransport(app=app_module.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://loadtest", cookies=cookies)
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=args.url, cookies=cookies, limits=limits, timeout=30)
+
+    async with client:
+        driver_ids = await discover_driver_ids(client)
+        samples = {name: [] for name in weights}
+        errors = {name: 0 for name in weights}
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(client, weights, driver_ids, deadline, samples, errors)
+                               for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    routes, total = summarize(samples, errors, elapsed)
+    return {
+        "target": "in-process" if args.in_process else args.url,
+        "duration_s": round(elapsed, 2),
+        "concurrency": args.concurrency,
+        "mix": weights,
+        "authenticated": bool(args.token),
+        "routes": routes,
+        "total": total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a mix of F1 Database routes and report latency percentiles.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running instance, e.g. http://localhost:8000")
+    target.add_argument("--in-process", action="store_true", help="drive main.app directly over ASGI")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run (default 30)")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent virtual users (default 10)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"route weights (default {DEFAULT_MIX})")
+    parser.add_argument("--token", help="Firebase token cookie to send; in-process runs accept 'loadtest-token'")
+    parser.add_argument("--output", default="loadtest_report.json", help="where to write the JSON report")
+    parser.add_argument("--baseline", help="previous report to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression ratio (default 0.10)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    print(f"{'route':<18}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in list(report["routes"].items()) + [("total", report["total"])]:
+        print(f"{name:<18}{stats['requests']:>10}{stats['errors']:>8}{stats['rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(report, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,108 @@
+import os
+import secrets
+
 PROJECT_NAME = "assignment01-453218"
 PROJECT_STORAGE_BUCKET = "assignment01-453218.appspot.com"
+
+# Server worker processes on this host (serve.py exports its --workers here). Limits
+# that are enforced per process but guard a shared resource are divided by it.
+WORKERS = int(os.environ.get("F1_WORKERS", "1"))
+
+# Set F1_SEED_ON_STARTUP=0 to skip seeding on boot and run `python seed.py` once instead
+SEED_ON_STARTUP = os.environ.get("F1_SEED_ON_STARTUP", "1") != "0"
+
+# Storage backends: F1_BACKEND=memory runs Firestore in-process, F1_BLOB_STORE=local
+# writes uploads under LOCAL_BLOB_DIR. Together they need no GCP credentials or network.
+BACKEND = os.environ.get("F1_BACKEND", "firestore")
+BLOB_STORE = os.environ.get("F1_BLOB_STORE", "local" if BACKEND == "memory" else "gcs")
+LOCAL_BLOB_DIR = os.environ.get("F1_LOCAL_BLOB_DIR", "local_blobs")
+
+# Per-request cost accounting: set F1_REQUEST_LOG=0 to silence the structured log line.
+# Requests issuing more single-document gets than the threshold on one collection are flagged as N+1.
+REQUEST_LOG = os.environ.get("F1_REQUEST_LOG", "1") != "0"
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("F1_N_PLUS_ONE_THRESHOLD", "5"))
+
+# Comma-separated emails allowed to use the admin-only diagnostics (profiling, memory)
+ADMIN_EMAILS = {email.strip() for email in os.environ.get("F1_ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# On-demand request profiler: sampling interval and where saved profiles are written
+PROFILE_INTERVAL_MS = float(os.environ.get("F1_PROFILE_INTERVAL_MS", "2"))
+PROFILE_DIR = os.environ.get("F1_PROFILE_DIR", "profiles")
+
+# Event-loop watchdog: lag sampling interval, and how long a callback may hold the loop
+# before its stack and route are recorded
+LOOP_LAG_INTERVAL_MS = float(os.environ.get("F1_LOOP_LAG_INTERVAL_MS", "100"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get("F1_LOOP_BLOCK_THRESHOLD_MS", "100"))
+
+# Firestore clients (one gRPC channel each) shared round-robin by requests in a worker.
+# The in-memory backend always uses a single store.
+FIRESTORE_POOL_SIZE = int(os.environ.get("F1_FIRESTORE_POOL_SIZE", "4"))
+
+# /readyz: every backend probe must answer within READY_LATENCY_MS; results are reused
+# for HEALTH_CACHE_SECONDS so health checks don't add backend load
+READY_LATENCY_MS = float(os.environ.get("F1_READY_LATENCY_MS", "500"))
+HEALTH_CACHE_SECONDS = float(os.environ.get("F1_HEALTH_CACHE_SECONDS", "10"))
+
+# Firestore resilience: default deadline for reads; the breaker opens after BREAKER_FAILURES
+# consecutive errors or calls slower than BREAKER_SLOW_MS (per RPC, so per batch of a stream)
+# and retries after BREAKER_RESET_SECONDS.
+# While it is open, read pages are served from the last known good copy (up to STALE_CACHE_ENTRIES).
+FIRESTORE_READ_TIMEOUT = float(os.environ.get("F1_FIRESTORE_READ_TIMEOUT", "5"))
+BREAKER_FAILURES = int(os.environ.get("F1_BREAKER_FAILURES", "5"))
+BREAKER_SLOW_MS = float(os.environ.get("F1_BREAKER_SLOW_MS", "2000"))
+BREAKER_RESET_SECONDS = float(os.environ.get("F1_BREAKER_RESET_SECONDS", "30"))
+STALE_CACHE_ENTRIES = int(os.environ.get("F1_STALE_CACHE_ENTRIES", "1000"))
+
+# Hedged single-document reads (opt-in): a duplicate read is sent when the first one is
+# slower than the HEDGE_PERCENTILE latency, for at most HEDGE_MAX_RATE of reads
+HEDGE_READS = os.environ.get("F1_HEDGE_READS", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("F1_HEDGE_PERCENTILE", "95"))
+HEDGE_MAX_RATE = float(os.environ.get("F1_HEDGE_MAX_RATE", "0.05"))
+HEDGE_WORKERS = int(os.environ.get("F1_HEDGE_WORKERS", "16"))
+
+# Admission control per worker: group=concurrency:queue. Requests beyond the queue, or
+# waiting longer than ADMISSION_QUEUE_TIMEOUT_MS, get 503 with Retry-After.
+ADMISSION_LIMITS = {
+    group: tuple(int(part) for part in limits.split(":"))
+    for group, limits in (
+        entry.strip().split("=")
+        for entry in os.environ.get("F1_ADMISSION_LIMITS", "reads=64:128,queries=16:32,writes=16:32,uploads=4:8,images=16:64").split(",")
+        if entry.strip()
+    )
+}
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.environ.get("F1_ADMISSION_QUEUE_TIMEOUT_MS", "1000"))
+
+# Largest image or logo accepted; checked while the upload streams in
+MAX_UPLOAD_BYTES = int(float(os.environ.get("F1_MAX_UPLOAD_MB", "10")) * 1024 * 1024)
+
+# Direct-to-bucket uploads: lifetime of signed upload URLs, and the key that signs the
+# object references handed to the browser (and local fake-GCS URLs). Every worker and
+# instance must share the key, so without F1_UPLOAD_SIGNING_SECRET direct uploads are off
+# (forms post the file through the app) unless a single worker serves a local bucket.
+SIGNED_UPLOAD_SECONDS = int(os.environ.get("F1_SIGNED_UPLOAD_SECONDS", "900"))
+UPLOAD_SIGNING_SECRET = os.environ.get("F1_UPLOAD_SIGNING_SECRET") or (
+    secrets.token_hex(32) if WORKERS == 1 and BLOB_STORE == "local" else "")
+DIRECT_UPLOADS = bool(UPLOAD_SIGNING_SECRET)
+
+# /img resizing proxy: processes resizing images per worker, and where resized copies
+# and their originals are cached on disk (least recently used evicted past the limit,
+# which is shared by all WORKERS). A path is served once a record is confirmed to point
+# at it; confirmations are reused for IMAGE_REFERENCE_TTL_SECONDS.
+IMAGE_WORKERS = int(os.environ.get("F1_IMAGE_WORKERS", "2"))
+IMAGE_CACHE_DIR = os.environ.get("F1_IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_BYTES = int(float(os.environ.get("F1_IMAGE_CACHE_MB", "512")) * 1024 * 1024)
+IMAGE_REFERENCE_TTL_SECONDS = float(os.environ.get("F1_IMAGE_REFERENCE_TTL_SECONDS", "60"))
+
+# Deferred side effects (blob deletes, making uploads public, creating user documents) go
+# through a SQLite job queue shared by the workers on one host. Failed jobs are retried
+# with exponential backoff; a claimed job reappears after JOB_VISIBILITY_SECONDS if its
+# worker dies.
+JOB_DB = os.environ.get("F1_JOB_DB", "jobs.sqlite3")
+JOB_WORKERS = int(os.environ.get("F1_JOB_WORKERS", "2"))
+JOB_POLL_MS = float(os.environ.get("F1_JOB_POLL_MS", "1000"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("F1_JOB_MAX_ATTEMPTS", "8"))
+JOB_VISIBILITY_SECONDS = float(os.environ.get("F1_JOB_VISIBILITY_SECONDS", "60"))
+
+# /analytics keeps a column copy of each collection. A worker's own writes refresh it at
+# once; writes made through other workers show up after ANALYTICS_TTL_SECONDS.
+ANALYTICS_TTL_SECONDS = float(os.environ.get("F1_ANALYTICS_TTL_SECONDS", "60"))
@@ -0,0 +1,99 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import local_constants
+import metrics
+
+logger = logging.getLogger("f1.loopwatch")
+
+
+def _route_from_stack(frame):
+    # Middleware and endpoint frames hold the ASGI scope, which carries the matched route
+    while frame is not None:
+        scope = frame.f_locals.get("scope")
+        if isinstance(scope, dict) and scope.get("type") == "http":
+            return scope.get("method"), metrics.route_label(scope)
+        frame = frame.f_back
+    return None, None
+
+
+class LoopWatchdog:
+    def __init__(self, interval, threshold, history=50):
+        self.interval = interval
+        self.threshold = threshold
+        self.events = collections.deque(maxlen=history)
+        self._heartbeat = time.perf_counter()
+        self._loop_thread_id = None
+        self._pending_event = None
+        self._reported_heartbeat = None
+        self._task = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._monitor())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+
+    async def _monitor(self):
+        # Lag is how late the loop wakes us up after a fixed sleep
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            self._heartbeat = now
+            metrics.LOOP_LAG.observe(lag)
+            event = self._pending_event
+            if event is not None:
+                event["blocked_ms"] = round(lag * 1000, 1)
+                logger.warning("Event loop blocked for %.1f ms on %s %s\n%s",
+                               lag * 1000, event["method"], event["route"], "".join(event["stack"]))
+                self._pending_event = None
+
+    def _watch(self):
+        check_interval = self.threshold / 2
+        while not self._stop.wait(check_interval):
+            heartbeat = self._heartbeat
+            if time.perf_counter() - heartbeat <= self.threshold + self.interval:
+                continue
+            if heartbeat == self._reported_heartbeat:
+                continue
+            # The loop hasn't ticked within the threshold: capture what is holding it
+            self._reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            method, route = _route_from_stack(frame)
+            event = {
+                "detected_at": time.time(),
+                "method": method,
+                "route": route,
+                "blocked_ms": None,
+                "stack": traceback.format_stack(frame),
+            }
+            metrics.LOOP_BLOCKS.labels(route or "none").inc()
+            self.events.append(event)
+            self._pending_event = event
+
+
+watchdog = LoopWatchdog(local_constants.LOOP_LAG_INTERVAL_MS / 1000, local_constants.LOOP_BLOCK_THRESHOLD_MS / 1000)
@@ -1,21 +1,188 @@
-from fastapi import FastAPI, Request, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+import asyncio
+import functools
+import hashlib
+import time
+import uuid
+from urllib.parse import quote
+from fastapi import FastAPI, Request, Form
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import google.oauth2.id_token
-from google.auth.transport import requests as google_requests
-from google.cloud import firestore, storage
 import starlette.status as status
+from starlette.concurrency import run_in_threadpool
 import local_constants
+import accounting
+import analytics
+import admission
+import backends
+import clientpool
+import export
+import fanout
+import filters
+import health
+import hedging
+import imaging
+import jobs
+import loopwatch
+import memprof
+import metrics
+import profiling
+import records
+import resilience
+import seed
+import uploads
 
 app = FastAPI()
+app.add_middleware(admission.AdmissionMiddleware, limits=local_constants.ADMISSION_LIMITS,
+                   queue_timeout=local_constants.ADMISSION_QUEUE_TIMEOUT_MS / 1000)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(accounting.AccountingMiddleware)
+app.add_middleware(memprof.MemoryProfilingMiddleware)
+
+firestore_breaker = resilience.CircuitBreaker(
+    "firestore",
+    local_constants.BREAKER_FAILURES,
+    local_constants.BREAKER_SLOW_MS / 1000,
+    local_constants.BREAKER_RESET_SECONDS,
+)
+stale_cache = resilience.StaleCache(firestore_breaker, local_constants.STALE_CACHE_ENTRIES)
+hedged_reader = None
+if local_constants.HEDGE_READS:
+    hedged_reader = hedging.HedgedReader(local_constants.HEDGE_PERCENTILE, local_constants.HEDGE_MAX_RATE,
+                                         local_constants.HEDGE_WORKERS)
+# Column tables for /analytics and filter queries, dropped whenever this worker writes to their collection
+analytics_store = analytics.AnalyticsStore(lambda collection: analytics.load_table(firestore_db, collection),
+                                           local_constants.ANALYTICS_TTL_SECONDS)
+backend_observers = [metrics.observe_backend_call, accounting.observe_backend_call, firestore_breaker.observe_backend_call,
+                     analytics_store.observe_backend_call]
+# Every in-memory store is a separate database, so that backend can't be pooled
+firestore_pool = clientpool.ClientPool(
+    backends.create_document_store,
+    local_constants.FIRESTORE_POOL_SIZE if local_constants.BACKEND == "firestore" else 1,
+)
+app.add_middleware(clientpool.ClientPoolMiddleware, pool=firestore_pool)
+firestore_db = backends.InstrumentedDocumentStore(firestore_pool, backend_observers,
+                                                  local_constants.FIRESTORE_READ_TIMEOUT, firestore_breaker.check)
+raw_blob_store = backends.create_blob_store()
+blob_store = backends.InstrumentedBlobStore(raw_blob_store, backend_observers)
+
+# Side effects that don't have to finish before a POST returns. Handlers may run more
+# than once, so each must be safe to repeat.
+job_queue = jobs.JobQueue(
+    local_constants.JOB_DB,
+    max_attempts=local_constants.JOB_MAX_ATTEMPTS,
+    visibility_timeout=local_constants.JOB_VISIBILITY_SECONDS,
+)
+
+@job_queue.handler("delete_blob")
+def delete_blob_job(path):
+    # Older uploads were stored as drivers/<filename>, so two records can share one object;
+    # checked when the job runs, after the write that dropped this record's reference
+    if image_is_referenced(path):
+        print(f"Keeping {path}: another record still uses it")
+        return
+    blob_store.delete(path)
+
+@job_queue.handler("publish_blob")
+def publish_blob_job(path):
+    blob_store.publish(path)
+
+@job_queue.handler("create_user")
+def create_user_job(user_id, user_data):
+    doc_ref = firestore_db.collection('users').document(user_id)
+    if not doc_ref.get().exists:
+        doc_ref.set(user_data)
 
-firestore_db = firestore.Client()
-firebase_request_adapter = google_requests.Request()
+def find_by_name(collection, name):
+    return list(firestore_db.collection(collection).where("name", "==", name).stream())
+
+def claim_upload(path):
+    # One claim document per direct-upload object, created atomically, so a token can be
+    # used by only one form even across workers and instances
+    claim_id = hashlib.sha256(path.encode()).hexdigest()
+    return backends.create_if_absent(firestore_db.collection("upload_claims").document(claim_id),
+                                     {"path": path, "claimed_at": time.time()})
+
+# Enqueueing is a SQLite write, so it runs in the threadpool like other blocking I/O
+async def publish_upload(form):
+    # Uploads stay private until the record pointing at them is saved
+    if form.file_url:
+        await run_in_threadpool(job_queue.enqueue, "publish_blob", {"path": form.file_path})
+
+async def delete_upload(url, prefix):
+    # Only uploaded files live under drivers/ and teams/; placeholders are shared
+    file_path = blob_store.path_from_url(url) if url else None
+    if file_path and file_path.startswith(prefix):
+        # A fresh key each time: an earlier delete of the same path may have been skipped
+        # because another record still used it then
+        await run_in_threadpool(job_queue.enqueue, "delete_blob", {"path": file_path},
+                                f"delete_blob:{file_path}:{uuid.uuid4().hex}")
+
+def create_firebase_request_adapter():
+    from google.auth.transport import requests as google_requests
+    return google_requests.Request()
+
+firebase_request_adapter = backends.LazyClient(create_firebase_request_adapter)
 
 app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory="templates")
-
+if isinstance(raw_blob_store, backends.LocalBlobStore):
+    app.mount(raw_blob_store.base_url, StaticFiles(directory=raw_blob_store.root), name='blobs')
+
+class TimedTemplates(Jinja2Templates):
+    def TemplateResponse(self, name, context, *args, **kwargs):
+        # base.html shows a banner when any read on this page came from the stale cache
+        context.setdefault("stale_data", resilience.served_stale())
+        with accounting.phase("render"):
+            return super().TemplateResponse(name, context, *args, **kwargs)
+
+templates = TimedTemplates(directory="templates")
+
+# Every worker indexes the cache directory separately, so each gets its share of the limit
+image_proxy = imaging.ImageProxy(
+    blob_store,
+    imaging.DiskCache(local_constants.IMAGE_CACHE_DIR, local_constants.IMAGE_CACHE_BYTES // local_constants.WORKERS),
+    local_constants.IMAGE_WORKERS,
+)
+
+# /img serves only images a driver or team record points at, plus the home page carousel;
+# anything else in the bucket (uploads not yet verified or saved, say) stays private
+IMAGE_FIELDS = {"drivers": "image_url", "teams": "logo_url"}
+SITE_IMAGES = frozenset({"carousel.jpg", "carousel2.jpg", "carousel3.png"})
+
+def proxied_image_path(url):
+    path = blob_store.path_from_url(url) if url else None
+    return path if path and (path in SITE_IMAGES or path.partition("/")[0] in IMAGE_FIELDS) else None
+
+def image_is_referenced(path):
+    collection, _, name = path.partition("/")
+    if collection not in IMAGE_FIELDS or not name:
+        return False
+    query = firestore_db.collection(collection).where(IMAGE_FIELDS[collection], "==", blob_store.public_url(path))
+    return bool(list(query.limit(1).stream()))
+
+referenced_images = imaging.ReferencedPaths(image_is_referenced, local_constants.IMAGE_REFERENCE_TTL_SECONDS)
+
+def resized(url, width, fmt="webp"):
+    # Template filter: route uploaded and carousel images through /img at the width the
+    # page shows them; anything else (external placeholders) is left as is
+    path = proxied_image_path(url)
+    if path is None:
+        return url
+    return f"/img/{quote(path)}?w={imaging.snap_width(width)}&fmt={fmt}"
+
+def srcset(url, *widths):
+    return ", ".join(f"{resized(url, width)} {width}w" for width in widths) if proxied_image_path(url) else ""
+
+templates.env.filters["resized"] = resized
+templates.env.filters["srcset"] = srcset
+templates.env.globals["direct_uploads"] = local_constants.DIRECT_UPLOADS
+
+def preload_templates():
+    for name in templates.env.list_templates():
+        templates.get_template(name)
+    metrics.set_cache_size("templates", len(templates.env.cache))
+
+@accounting.timed("user")
 def get_user(user_token):
     doc_ref = firestore_db.collection('users').document(user_token['user_id'])
     doc = doc_ref.get()
@@ -25,12 +192,28 @@ def get_user(user_token):
             "name": user_token.get("email", "John Doe"),
             "email": user_token.get("email", "Unknown")
         }
-        doc_ref.set(user_data)
-    return doc_ref
+        # Until the job has run, repeat visits enqueue the same key, which is a no-op
+        job_queue.enqueue("create_user", {"user_id": user_token['user_id'], "user_data": user_data},
+                          key=f"create_user:{user_token['user_id']}")
+        return user_data
+    return doc.to_dict()
+
+async def fetch_with_user(user_token, *calls):
+    # The signed-in user's profile doesn't depend on the page's own reads, so it is
+    # fetched alongside them; returns [user_info, *results]
+    resilience.track_stale_reads()
+    user_call = stale_cache.reader(("users", user_token["user_id"]), lambda: get_user(user_token)) if user_token else dict
+    results = await fanout.gather(user_call, *calls)
+    if user_token:
+        user_token["email"] = results[0].get("email", "Unknown")
+    return results
 
+@accounting.timed("auth")
 def validate_firebase_token(id_token: str):
     if not id_token:
         return None
+    # Imported on first use: google-auth's JWT/crypto stack is a large share of cold start
+    import google.oauth2.id_token
     try:
         user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
         return user_token
@@ -38,32 +221,123 @@ def validate_firebase_token(id_token: str):
         print(f"Token validation error: {err}")
         return None
 
+def documents_to_dicts(docs):
+    records = []
+    for doc in docs:
+        record = doc.to_dict()
+        record["id"] = doc.id
+        records.append(record)
+    return records
+
+# Reads for pages that may fall back to the last known good copy during a Firestore outage.
+# Edit forms always read live data. Collections are kept as compact column
+# tables, since the stale cache holds on to every one of them.
+def read_collection(collection):
+    return stale_cache.reader(
+        (collection,), lambda: records.ColumnTable.from_documents(collection, firestore_db.collection(collection).stream()))
+
+def read_document(collection, document_id):
+    return stale_cache.reader((collection, document_id), get_document(collection, document_id))
+
+# Live single-document read, hedged when F1_HEDGE_READS=1
+def get_document(collection, document_id):
+    call = firestore_db.collection(collection).document(document_id).get
+    return hedged_reader.reader(collection, call) if hedged_reader else call
+
+# Filter queries run against this worker's column table while it is fresh, which needs no
+# Firestore read at all. Otherwise they are pushed down to Firestore when its single-field
+# indexes can serve them; anything else (ranges on two fields, say) loads the table.
+async def run_filter_query(user_token, expression):
+    collection = expression.collection
+    table = analytics_store.cached_table(collection)
+    if table is None and expression.pushdown:
+        metrics.FILTER_QUERIES.labels(collection, "firestore").inc()
+        # Built in the worker thread: the first call imports the Firestore client library
+        query = lambda: firestore_db.collection(collection).where(filter=expression.firestore_filter()).stream()
+        _, rows = await fetch_with_user(user_token, lambda: documents_to_dicts(query()))
+        return rows
+    if table is None:
+        metrics.FILTER_QUERIES.labels(collection, "load").inc()
+        _, (table, _) = await asyncio.gather(fetch_with_user(user_token), analytics_store.table(collection))
+    else:
+        metrics.FILTER_QUERIES.labels(collection, "table").inc()
+        await fetch_with_user(user_token)
+    return expression.select(table)
+
+async def query_form(request, user_token, collection, expression="", error_message=None):
+    await fetch_with_user(user_token)
+    context = {"request": request, "user_token": user_token, "fields": filters.QUERY_FIELDS[collection],
+               "expression": expression, "error_message": error_message}
+    return templates.TemplateResponse(f"query_{collection}.html", context, status_code=400 if error_message else 200)
+
+# Form fields of the add/edit pages; the image or logo is handled separately
+DRIVER_FORM_FIELDS = [field for field in export.DRIVER_FIELDS if field not in ("id", "image_url")]
+TEAM_FORM_FIELDS = [field for field in export.TEAM_FIELDS if field not in ("id", "logo_url")]
+
+def compare_driver_stats(driver1, driver2):
+    stats = ["age", "total_pole_positions", "total_race_wins", "total_points_scored", "total_world_titles", "total_fastest_laps"]
+    comparison = []
+    for stat in stats:
+        value1 = driver1.get(stat, 0)
+        value2 = driver2.get(stat, 0)
+        
+        if stat == "age":
+            if value1 < value2:
+                better = "driver1"
+            elif value2 < value1:
+                better = "driver2"
+            else:
+                better = "equal"
+        else:
+            if value1 > value2:
+                better = "driver1"
+            elif value2 > value1:
+                better = "driver2"
+            else:
+                better = "equal"
+        comparison.append({"stat": stat,"driver1_value": value1,"driver2_value": value2,"better": better})
+    return comparison
+
+def compare_team_stats(team1, team2):
+    stats = ["year_founded", "total_pole_positions", "total_race_wins", "total_constructor_titles", "finishing_position_previous_season"]
+    comparison = []
+    for stat in stats:
+        value1 = team1.get(stat, 0)
+        value2 = team2.get(stat, 0)
+
+        if stat in ["year_founded", "finishing_position_previous_season"]:
+            if value1 < value2:
+                better = "team1"
+            elif value2 < value1:
+                better = "team2"
+            else:
+                better = "equal"
+        else:
+            if value1 > value2:
+                better = "team1"
+            elif value2 > value1:
+                better = "team2"
+            else:
+                better = "equal"
+        comparison.append({"stat": stat,"team1_value": value1,"team2_value": value2,"better": better})
+    return comparison
+
+def is_admin(id_token):
+    user_token = validate_firebase_token(id_token)
+    return bool(user_token) and user_token.get("email") in local_constants.ADMIN_EMAILS
+
+app.add_middleware(profiling.ProfilingMiddleware, is_admin=is_admin)
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     id_token = request.cookies.get("token")
     error_message = ""
     user_token = validate_firebase_token(id_token)
-    user_info = {}
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-
-    drivers_ref = firestore_db.collection("drivers")
-    drivers = []
-    for doc in drivers_ref.stream():
-        d = doc.to_dict()
-        d["id"] = doc.id
-        drivers.append(d)
-
-    teams_ref = firestore_db.collection("teams")
-    teams = []
-    for doc in teams_ref.stream():
-        t = doc.to_dict()
-        t["id"] = doc.id
-        teams.append(t)
+    user_info, drivers, teams = await fetch_with_user(
+        user_token,
+        read_collection("drivers"),
+        read_collection("teams"),
+    )
 
     return templates.TemplateResponse("main.html", {
         "request": request,
@@ -74,6 +348,12 @@ async def root(request: Request):
         "teams": teams
     })
 
+@app.exception_handler(resilience.BackendUnavailable)
+async def backend_unavailable(request: Request, exc: resilience.BackendUnavailable):
+    retry_after = str(int(local_constants.BREAKER_RESET_SECONDS))
+    return HTMLResponse("The database is temporarily unavailable. Please try again shortly.",
+                        status_code=503, headers={"Retry-After": retry_after})
+
 # Authentication Endpoints
 
 @app.get("/login", response_class=HTMLResponse)
@@ -98,19 +378,7 @@ async def list_drivers(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
 
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-
-    drivers_ref = firestore_db.collection("drivers")
-    drivers = []
-    for doc in drivers_ref.stream():
-        d = doc.to_dict()
-        d["id"] = doc.id
-        drivers.append(d)
+    _, drivers = await fetch_with_user(user_token, read_collection("drivers"))
     
     return templates.TemplateResponse("drivers_list.html", {"request": request,"drivers": drivers,"user_token": user_token})
 
@@ -118,37 +386,18 @@ async def list_drivers(request: Request):
 async def query_drivers_form(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-    return templates.TemplateResponse("query_drivers.html", {"request": request, "user_token": user_token})
+    return await query_form(request, user_token, "drivers")
 
 @app.post("/drivers/query", response_class=HTMLResponse)
-async def query_drivers(request: Request, attribute: str = Form(...), operator: str = Form(...), value: str = Form(...)):
+async def query_drivers(request: Request, expression: str = Form(...)):
+    # e.g. team == "Ferrari" and total_race_wins > 5 or age < 25
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-
-    drivers_ref = firestore_db.collection("drivers")
-    if attribute in ["age", "total_pole_positions", "total_race_wins", "total_points_scored", "total_world_titles", "total_fastest_laps"]:
-        try:
-            value = int(value)
-        except ValueError:
-            return HTMLResponse("Invalid numeric value provided.", status_code=400)
-    query = drivers_ref.where(attribute, operator, value)
-    drivers = []
-    for doc in query.stream():
-        d = doc.to_dict()
-        d["id"] = doc.id
-        drivers.append(d)
+    try:
+        compiled = filters.compile_expression("drivers", expression)
+    except filters.FilterError as err:
+        return await query_form(request, user_token, "drivers", expression, str(err))
+    drivers = await run_filter_query(user_token, compiled)
     context = {"request": request, "drivers": drivers, "user_token": user_token}
     if not drivers:
         context["message"] = "No drivers found matching your query."
@@ -159,74 +408,41 @@ async def query_drivers(request: Request, attribute: str = Form(...), operator:
 async def add_driver_form(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
+    await fetch_with_user(user_token)
     return templates.TemplateResponse("add_driver.html", {"request": request, "user_token": user_token})
 
 
 @app.post("/drivers/add", response_class=RedirectResponse)
-async def add_driver(
-    request: Request,
-    name: str = Form(...),
-    age: int = Form(...),
-    total_pole_positions: int = Form(...),
-    total_race_wins: int = Form(...),
-    total_points_scored: int = Form(...),
-    total_world_titles: int = Form(...),
-    total_fastest_laps: int = Form(...),
-    team: str = Form(...),
-    image: UploadFile = File(None)
-):
+async def add_driver(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
     if not user_token:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
 
-    existing_drivers = list(firestore_db.collection("drivers").where("name", "==", name).stream())
-    if existing_drivers:
+    form = uploads.StreamingForm(request, blob_store, "image", "drivers", local_constants.MAX_UPLOAD_BYTES,
+                                 user_id=user_token["user_id"], claim_upload=claim_upload)
+    try:
+        await form.parse()
+        driver_data = uploads.form_values(form.fields, DRIVER_FORM_FIELDS, export.NUMERIC_FIELDS)
+    except uploads.UploadError as err:
+        await form.discard()
+        return HTMLResponse(err.message, status_code=err.status_code)
+
+    if await run_in_threadpool(find_by_name, "drivers", driver_data["name"]):
+        await form.discard()
         return HTMLResponse("Driver with the same name already exists.", status_code=400)
 
-    if image is not None and image.filename != "":
-        image.file.seek(0)
-        storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-        bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
-        blob = bucket.blob(f"drivers/{image.filename}")
-        blob.upload_from_file(image.file, content_type=image.content_type)
-        blob.make_public()
-        image_url = blob.public_url
-    else:
-        image_url = "https://storage.googleapis.com/assignment01-453218.appspot.com/placeholder.png"
-
-    driver_data = {
-        "name": name,
-        "age": age,
-        "total_pole_positions": total_pole_positions,
-        "total_race_wins": total_race_wins,
-        "total_points_scored": total_points_scored,
-        "total_world_titles": total_world_titles,
-        "total_fastest_laps": total_fastest_laps,
-        "team": team,
-        "image_url": image_url,
-    }
-
-    firestore_db.collection("drivers").add(driver_data)
+    driver_data["image_url"] = form.file_url or "https://storage.googleapis.com/assignment01-453218.appspot.com/placeholder.png"
+
+    await run_in_threadpool(firestore_db.collection("drivers").add, driver_data)
+    await publish_upload(form)
     return RedirectResponse(url="/drivers", status_code=status.HTTP_302_FOUND)
 
 @app.get("/drivers/{driver_id}", response_class=HTMLResponse)
 async def driver_details(request: Request, driver_id: str):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-    doc = firestore_db.collection("drivers").document(driver_id).get()
+    _, doc = await fetch_with_user(user_token, read_document("drivers", driver_id))
     if not doc.exists:
         return HTMLResponse("Driver not found", status_code=404)
     driver = doc.to_dict()
@@ -238,13 +454,7 @@ async def driver_details(request: Request, driver_id: str):
 async def edit_driver_form(request: Request, driver_id: str):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-    doc = firestore_db.collection("drivers").document(driver_id).get()
+    _, doc = await fetch_with_user(user_token, get_document("drivers", driver_id))
     if not doc.exists:
         return HTMLResponse("Driver not found", status_code=404)
     driver = doc.to_dict()
@@ -253,52 +463,38 @@ async def edit_driver_form(request: Request, driver_id: str):
 
 
 @app.post("/drivers/edit/{driver_id}", response_class=RedirectResponse)
-async def edit_driver(
-    request: Request,
-    driver_id: str,
-    name: str = Form(...),
-    age: int = Form(...),
-    total_pole_positions: int = Form(...),
-    total_race_wins: int = Form(...),
-    total_points_scored: int = Form(...),
-    total_world_titles: int = Form(...),
-    total_fastest_laps: int = Form(...),
-    team: str = Form(...),
-    image: UploadFile = File(None)
-):
+async def edit_driver(request: Request, driver_id: str):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
     if not user_token:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
 
-    duplicate_drivers = [
-        doc for doc in firestore_db.collection("drivers").where("name", "==", name).stream()
-        if doc.id != driver_id
-    ]
-    if duplicate_drivers:
+    form = uploads.StreamingForm(request, blob_store, "image", "drivers", local_constants.MAX_UPLOAD_BYTES,
+                                 user_id=user_token["user_id"], record_id=driver_id,
+                                 claim_upload=claim_upload)
+    try:
+        await form.parse()
+        driver_data = uploads.form_values(form.fields, DRIVER_FORM_FIELDS, export.NUMERIC_FIELDS)
+    except uploads.UploadError as err:
+        await form.discard()
+        return HTMLResponse(err.message, status_code=err.status_code)
+
+    driver_ref = firestore_db.collection("drivers").document(driver_id)
+    # The previous image is only needed when a new one replaces it
+    named, previous = await fanout.gather(lambda: find_by_name("drivers", driver_data["name"]),
+                                          driver_ref.get if form.file_url else lambda: None)
+    if any(doc.id != driver_id for doc in named):
+        await form.discard()
         return HTMLResponse("Driver with the same name already exists.", status_code=400)
 
-    driver_data = {
-        "name": name,
-        "age": age,
-        "total_pole_positions": total_pole_positions,
-        "total_race_wins": total_race_wins,
-        "total_points_scored": total_points_scored,
-        "total_world_titles": total_world_titles,
-        "total_fastest_laps": total_fastest_laps,
-        "team": team,
-    }
-
-    if image is not None and image.filename != "":
-        image.file.seek(0)
-        storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-        bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
-        blob = bucket.blob(f"drivers/{image.filename}")
-        blob.upload_from_file(image.file, content_type=image.content_type)
-        blob.make_public()
-        driver_data["image_url"] = blob.public_url
-
-    firestore_db.collection("drivers").document(driver_id).update(driver_data)
+    if form.file_url:
+        driver_data["image_url"] = form.file_url
+
+    await run_in_threadpool(driver_ref.update, driver_data)
+    await publish_upload(form)
+    # The replaced upload goes only once the record no longer points at it
+    if previous is not None and previous.exists:
+        await delete_upload(previous.to_dict().get("image_url"), "drivers/")
     return RedirectResponse(url=f"/drivers/{driver_id}", status_code=status.HTTP_302_FOUND)
 
 @app.post("/drivers/delete/{driver_id}", response_class=RedirectResponse)
@@ -309,23 +505,10 @@ async def delete_driver(driver_id: str, request: Request):
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
     driver_ref = firestore_db.collection("drivers").document(driver_id)
-    driver_doc = driver_ref.get()
+    driver_doc = await run_in_threadpool(driver_ref.get)
+    await run_in_threadpool(driver_ref.delete)
     if driver_doc.exists:
-        driver = driver_doc.to_dict()
-        image_url = driver.get("image_url")
-        if image_url and "placeholder_driver.jpg" not in image_url:
-            from urllib.parse import urlparse
-            parsed_url = urlparse(image_url)
-            file_path = parsed_url.path.lstrip('/')
-            try:
-                storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-                bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
-                blob = bucket.blob(file_path)
-                blob.delete()
-                print("Deleted image:", image_url)
-            except Exception as e:
-                print("Error deleting image:", e)
-    driver_ref.delete()
+        await delete_upload(driver_doc.to_dict().get("image_url"), "drivers/")
     return RedirectResponse(url="/drivers", status_code=status.HTTP_302_FOUND)
 
 # Team Endpoints
@@ -334,18 +517,7 @@ async def delete_driver(driver_id: str, request: Request):
 async def list_teams(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-    teams_ref = firestore_db.collection("teams")
-    teams = []
-    for doc in teams_ref.stream():
-        t = doc.to_dict()
-        t["id"] = doc.id
-        teams.append(t)
+    _, teams = await fetch_with_user(user_token, read_collection("teams"))
     return templates.TemplateResponse("teams_list.html", {"request": request, "teams": teams, "user_token": user_token})
 
 
@@ -353,38 +525,18 @@ async def list_teams(request: Request):
 async def query_teams_form(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-    return templates.TemplateResponse("query_teams.html", {"request": request, "user_token": user_token})
+    return await query_form(request, user_token, "teams")
 
 
 @app.post("/teams/query", response_class=HTMLResponse)
-async def query_teams(request: Request, attribute: str = Form(...), operator: str = Form(...), value: str = Form(...)):
+async def query_teams(request: Request, expression: str = Form(...)):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-
-    teams_ref = firestore_db.collection("teams")
-    if attribute in ["year_founded", "total_pole_positions", "total_race_wins", "total_constructor_titles", "finishing_position_previous_season"]:
-        try:
-            value = int(value)
-        except ValueError:
-            return HTMLResponse("Invalid numeric value provided.", status_code=400)
-    query = teams_ref.where(attribute, operator, value)
-    teams = []
-    for doc in query.stream():
-        t = doc.to_dict()
-        t["id"] = doc.id
-        teams.append(t)
+    try:
+        compiled = filters.compile_expression("teams", expression)
+    except filters.FilterError as err:
+        return await query_form(request, user_token, "teams", expression, str(err))
+    teams = await run_filter_query(user_token, compiled)
     context = {"request": request, "teams": teams, "user_token": user_token}
     if not teams:
         context["message"] = "No teams found matching your query."
@@ -395,85 +547,50 @@ async def query_teams(request: Request, attribute: str = Form(...), operator: st
 async def add_team_form(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
+    await fetch_with_user(user_token)
     return templates.TemplateResponse("add_team.html", {"request": request, "user_token": user_token})
 
 
 @app.post("/teams/add", response_class=RedirectResponse)
-async def add_team(
-    request: Request,
-    name: str = Form(...),
-    year_founded: int = Form(...),
-    total_pole_positions: int = Form(...),
-    total_race_wins: int = Form(...),
-    total_constructor_titles: int = Form(...),
-    finishing_position_previous_season: int = Form(...),
-    logo: UploadFile = File(None)
-):
+async def add_team(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
     if not user_token:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
+
+    form = uploads.StreamingForm(request, blob_store, "logo", "teams", local_constants.MAX_UPLOAD_BYTES,
+                                 user_id=user_token["user_id"], claim_upload=claim_upload)
+    try:
+        await form.parse()
+        team_data = uploads.form_values(form.fields, TEAM_FORM_FIELDS, export.NUMERIC_FIELDS)
+    except uploads.UploadError as err:
+        await form.discard()
+        return HTMLResponse(err.message, status_code=err.status_code)
     
-    existing_teams = list(firestore_db.collection("teams").where("name", "==", name).stream())
-    if existing_teams:
+    if await run_in_threadpool(find_by_name, "teams", team_data["name"]):
+        await form.discard()
         return HTMLResponse("Team with the same name already exists.", status_code=400)
+
+    team_data["logo_url"] = form.file_url or "https://storage.googleapis.com/assignment01-453218.appspot.com/placeholder-team.png"
     
-    if logo is not None and logo.filename != "":
-        try:
-            logo.file.seek(0)
-            storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-            bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
-            blob = bucket.blob(f"teams/{logo.filename}")
-            blob.upload_from_file(logo.file, content_type=logo.content_type)
-            blob.make_public()
-            logo_url = blob.public_url
-        except Exception as e:
-            print("Error uploading logo:", e)
-            return HTMLResponse("Error uploading logo.", status_code=500)
-    else:
-        logo_url = "https://storage.googleapis.com/assignment01-453218.appspot.com/placeholder-team.png"
-    
-    team_data = {
-        "name": name,
-        "year_founded": year_founded,
-        "total_pole_positions": total_pole_positions,
-        "total_race_wins": total_race_wins,
-        "total_constructor_titles": total_constructor_titles,
-        "finishing_position_previous_season": finishing_position_previous_season,
-        "logo_url": logo_url,
-    }
-    
-    firestore_db.collection("teams").add(team_data)
+    await run_in_threadpool(firestore_db.collection("teams").add, team_data)
+    await publish_upload(form)
     return RedirectResponse(url="/teams", status_code=status.HTTP_302_FOUND)
 
 @app.get("/teams/{team_id}", response_class=HTMLResponse)
 async def team_details(request: Request, team_id: str):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-    doc = firestore_db.collection("teams").document(team_id).get()
+    _, doc = await fetch_with_user(user_token, read_document("teams", team_id))
     if not doc.exists:
         return HTMLResponse("Team not found", status_code=404)
     team = doc.to_dict()
     team["id"] = team_id
 
+    # Needs the team's name, so it can't join the fan-out above; still kept off the event loop
     drivers_ref = firestore_db.collection("drivers").where("team", "==", team["name"])
-    drivers = []
-    for doc in drivers_ref.stream():
-        d = doc.to_dict()
-        d["id"] = doc.id
-        drivers.append(d)
+    drivers = await run_in_threadpool(stale_cache.read, ("drivers", "team", team["name"]),
+                                      lambda: records.ColumnTable.from_documents("drivers", drivers_ref.stream()))
     return templates.TemplateResponse("team_details.html", {"request": request, "team": team, "drivers": drivers, "user_token": user_token})
 
 
@@ -481,13 +598,7 @@ async def team_details(request: Request, team_id: str):
 async def edit_team_form(request: Request, team_id: str):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-    doc = firestore_db.collection("teams").document(team_id).get()
+    _, doc = await fetch_with_user(user_token, get_document("teams", team_id))
     if not doc.exists:
         return HTMLResponse("Team not found", status_code=404)
     team = doc.to_dict()
@@ -496,48 +607,38 @@ async def edit_team_form(request: Request, team_id: str):
 
 
 @app.post("/teams/edit/{team_id}", response_class=RedirectResponse)
-async def edit_team(
-    request: Request,
-    team_id: str,
-    name: str = Form(...),
-    year_founded: int = Form(...),
-    total_pole_positions: int = Form(...),
-    total_race_wins: int = Form(...),
-    total_constructor_titles: int = Form(...),
-    finishing_position_previous_season: int = Form(...),
-    logo: UploadFile = File(None)
-):
+async def edit_team(request: Request, team_id: str):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
     if not user_token:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
+
+    form = uploads.StreamingForm(request, blob_store, "logo", "teams", local_constants.MAX_UPLOAD_BYTES,
+                                 user_id=user_token["user_id"], record_id=team_id,
+                                 claim_upload=claim_upload)
+    try:
+        await form.parse()
+        team_data = uploads.form_values(form.fields, TEAM_FORM_FIELDS, export.NUMERIC_FIELDS)
+    except uploads.UploadError as err:
+        await form.discard()
+        return HTMLResponse(err.message, status_code=err.status_code)
     
-    duplicate_teams = [
-        doc for doc in firestore_db.collection("teams").where("name", "==", name).stream()
-        if doc.id != team_id
-    ]
-    if duplicate_teams:
+    team_ref = firestore_db.collection("teams").document(team_id)
+    # The previous logo is only needed when a new one replaces it
+    named, previous = await fanout.gather(lambda: find_by_name("teams", team_data["name"]),
+                                          team_ref.get if form.file_url else lambda: None)
+    if any(doc.id != team_id for doc in named):
+        await form.discard()
         return HTMLResponse("Team with the same name already exists.", status_code=400)
 
-    team_data = {
-        "name": name,
-        "year_founded": year_founded,
-        "total_pole_positions": total_pole_positions,
-        "total_race_wins": total_race_wins,
-        "total_constructor_titles": total_constructor_titles,
-        "finishing_position_previous_season": finishing_position_previous_season,
-    }
-
-    if logo is not None and logo.filename != "":
-        logo.file.seek(0)
-        storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-        bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
-        blob = bucket.blob(f"teams/{logo.filename}")
-        blob.upload_from_file(logo.file, content_type=logo.content_type)
-        blob.make_public()
-        team_data["logo_url"] = blob.public_url
-
-    firestore_db.collection("teams").document(team_id).update(team_data)
+    if form.file_url:
+        team_data["logo_url"] = form.file_url
+
+    await run_in_threadpool(team_ref.update, team_data)
+    await publish_upload(form)
+    # The replaced upload goes only once the record no longer points at it
+    if previous is not None and previous.exists:
+        await delete_upload(previous.to_dict().get("logo_url"), "teams/")
     return RedirectResponse(url=f"/teams/{team_id}", status_code=status.HTTP_302_FOUND)
 
 @app.post("/teams/delete/{team_id}", response_class=RedirectResponse)
@@ -548,23 +649,10 @@ async def delete_team(team_id: str, request: Request):
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
     team_ref = firestore_db.collection("teams").document(team_id)
-    team_doc = team_ref.get()
+    team_doc = await run_in_threadpool(team_ref.get)
+    await run_in_threadpool(team_ref.delete)
     if team_doc.exists:
-        team = team_doc.to_dict()
-        logo_url = team.get("logo_url")
-        if logo_url and "placeholder_team.jpg" not in logo_url:
-            from urllib.parse import urlparse
-            parsed_url = urlparse(logo_url)
-            file_path = parsed_url.path.lstrip('/')
-            try:
-                storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-                bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
-                blob = bucket.blob(file_path)
-                blob.delete()
-                print("Deleted logo:", logo_url)
-            except Exception as e:
-                print("Error deleting logo:", e)
-    team_ref.delete()
+        await delete_upload(team_doc.to_dict().get("logo_url"), "teams/")
     return RedirectResponse(url="/teams", status_code=status.HTTP_302_FOUND)
 
 # Comparison Endpoints
@@ -573,15 +661,7 @@ async def delete_team(team_id: str, request: Request):
 async def compare_drivers_form(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-
-    drivers_ref = firestore_db.collection("drivers")
-    drivers = [doc.to_dict() | {"id": doc.id} for doc in drivers_ref.stream()]
+    _, drivers = await fetch_with_user(user_token, read_collection("drivers"))
     return templates.TemplateResponse("compare_drivers_form.html", {"request": request,"drivers": drivers,"user_token": user_token})
 
 @app.post("/compare/drivers", response_class=HTMLResponse)
@@ -595,41 +675,17 @@ async def compare_drivers(
     
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-
-    doc1 = firestore_db.collection("drivers").document(driver1_id).get()
-    doc2 = firestore_db.collection("drivers").document(driver2_id).get()
+    _, doc1, doc2 = await fetch_with_user(
+        user_token,
+        read_document("drivers", driver1_id),
+        read_document("drivers", driver2_id),
+    )
     if not doc1.exists or not doc2.exists:
         return HTMLResponse("One or both drivers not found", status_code=404)
     driver1 = doc1.to_dict()
     driver2 = doc2.to_dict()
 
-    stats = ["age", "total_pole_positions", "total_race_wins", "total_points_scored", "total_world_titles", "total_fastest_laps"]
-    comparison = []
-    for stat in stats:
-        value1 = driver1.get(stat, 0)
-        value2 = driver2.get(stat, 0)
-        
-        if stat == "age":
-            if value1 < value2:
-                better = "driver1"
-            elif value2 < value1:
-                better = "driver2"
-            else:
-                better = "equal"
-        else:
-            if value1 > value2:
-                better = "driver1"
-            elif value2 > value1:
-                better = "driver2"
-            else:
-                better = "equal"
-        comparison.append({"stat": stat,"driver1_value": value1,"driver2_value": value2,"better": better})
+    comparison = compare_driver_stats(driver1, driver2)
 
     return templates.TemplateResponse("compare_drivers.html", {"request": request,"driver1": driver1,"driver2": driver2,"comparison": comparison,"user_token": user_token})
 
@@ -638,15 +694,7 @@ async def compare_drivers(
 async def compare_teams_form(request: Request):
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-
-    teams_ref = firestore_db.collection("teams")
-    teams = [doc.to_dict() | {"id": doc.id} for doc in teams_ref.stream()]
+    _, teams = await fetch_with_user(user_token, read_collection("teams"))
     return templates.TemplateResponse("compare_teams_form.html", {"request": request,"teams": teams,"user_token": user_token})
 
 
@@ -661,174 +709,281 @@ async def compare_teams(
     
     id_token = request.cookies.get("token")
     user_token = validate_firebase_token(id_token)
-    if user_token:
-        user_doc = get_user(user_token)
-        user_info = user_doc.get().to_dict()
-        user_token["email"] = user_info.get("email", "Unknown")
-    else:
-        user_token = None
-
-    doc1 = firestore_db.collection("teams").document(team1_id).get()
-    doc2 = firestore_db.collection("teams").document(team2_id).get()
+    _, doc1, doc2 = await fetch_with_user(
+        user_token,
+        read_document("teams", team1_id),
+        read_document("teams", team2_id),
+    )
     if not doc1.exists or not doc2.exists:
         return HTMLResponse("One or both teams not found", status_code=404)
     team1 = doc1.to_dict()
     team2 = doc2.to_dict()
 
-    stats = ["year_founded", "total_pole_positions", "total_race_wins", "total_constructor_titles", "finishing_position_previous_season"]
-    comparison = []
-    for stat in stats:
-        value1 = team1.get(stat, 0)
-        value2 = team2.get(stat, 0)
-
-        if stat in ["year_founded", "finishing_position_previous_season"]:
-            if value1 < value2:
-                better = "team1"
-            elif value2 < value1:
-                better = "team2"
-            else:
-                better = "equal"
-        else:
-            if value1 > value2:
-                better = "team1"
-            elif value2 > value1:
-                better = "team2"
-            else:
-                better = "equal"
-        comparison.append({"stat": stat,"team1_value": value1,"team2_value": value2,"better": better})
+    comparison = compare_team_stats(team1, team2)
 
     return templates.TemplateResponse("compare_teams.html", {"request": request,"team1": team1,"team2": team2,"comparison": comparison,"user_token": user_token})
 
+# Export Endpoints
+
+@app.get("/export/{collection}")
+async def export_collection(collection: str, format: str = "csv"):
+    if collection not in export.EXPORT_FIELDS:
+        return HTMLResponse("Unknown collection", status_code=404)
+    if format not in export.MEDIA_TYPES:
+        return HTMLResponse("Unsupported export format. Use csv or ndjson.", status_code=400)
+    chunks = export.stream_export(firestore_db.collection(collection), collection, format)
+    headers = {"Content-Disposition": f'attachment; filename="{collection}.{format}"'}
+    return StreamingResponse(chunks, media_type=export.MEDIA_TYPES[format], headers=headers)
+
+# Direct Upload Endpoints
+
+@app.post("/uploads/sign")
+async def sign_upload(request: Request):
+    # The browser PUTs the image straight to the bucket, then posts the form with the object token
+    if not local_constants.DIRECT_UPLOADS:
+        return JSONResponse({"error": "Direct uploads are disabled"}, status_code=404)
+    user_token = validate_firebase_token(request.cookies.get("token"))
+    if not user_token:
+        return JSONResponse({"error": "Login required"}, status_code=401)
+    try:
+        upload = await request.json()
+        kind, file_name = upload["kind"], upload["filename"]
+        content_type, size = upload["content_type"], int(upload["size"])
+        # The record being edited, or "" for a new one
+        record_id = str(upload.get("record", ""))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JSONResponse({"error": "Expected kind, filename, content_type and size"}, status_code=400)
+    if kind not in ("drivers", "teams") or not file_name:
+        return JSONResponse({"error": "Unknown upload kind"}, status_code=400)
+    if content_type not in uploads.IMAGE_TYPES:
+        return JSONResponse({"error": "Upload a JPEG, PNG, GIF or WebP file."}, status_code=415)
+    if size > local_constants.MAX_UPLOAD_BYTES:
+        return JSONResponse({"error": "File too large"}, status_code=413)
+
+    path = uploads.stored_path(kind, file_name)
+    url = await run_in_threadpool(blob_store.signed_upload_url, path, content_type,
+                                  local_constants.SIGNED_UPLOAD_SECONDS)
+    token = uploads.object_token(kind, user_token["user_id"], record_id, path, local_constants.SIGNED_UPLOAD_SECONDS)
+    return {"url": url, "method": "PUT", "headers": {"Content-Type": content_type}, "object": token}
+
+
+if local_constants.DIRECT_UPLOADS and isinstance(raw_blob_store, backends.LocalBlobStore):
+    # Fake bucket endpoint for local runs: accepts the same signed PUTs GCS would
+    @app.put(raw_blob_store.upload_url + "/{path:path}")
+    async def put_local_blob(request: Request, path: str, expires: str = "", signature: str = ""):
+        content_type = request.headers.get("content-type", "")
+        if not raw_blob_store.check_signed_upload(path, content_type, expires, signature):
+            return Response("Invalid or expired signature", status_code=403)
+        writer = await run_in_threadpool(blob_store.open_writer, path, content_type)
+        size = 0
+        try:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > local_constants.MAX_UPLOAD_BYTES:
+                    raise uploads.UploadError("File too large", 413)
+                await run_in_threadpool(writer.write, chunk)
+        except BaseException as err:
+            await run_in_threadpool(writer.abort)
+            if isinstance(err, uploads.UploadError):
+                return Response(err.message, status_code=err.status_code)
+            raise
+        await run_in_threadpool(writer.close)
+        return Response(status_code=200)
+
+# Analytics Endpoints
+
+@app.get("/analytics/{collection}/summary")
+async def analytics_summary(collection: str, fields: str, group_by: str = None, agg: str = "count,sum,mean,min,max"):
+    # e.g. /analytics/drivers/summary?group_by=team&fields=total_race_wins,age&agg=sum,mean
+    if collection not in export.EXPORT_FIELDS:
+        return JSONResponse({"error": "Unknown collection"}, status_code=404)
+    try:
+        return await analytics_store.group_by(collection, group_by or None, _split(fields), _split(agg))
+    except analytics.AnalyticsError as err:
+        return JSONResponse({"error": str(err)}, status_code=400)
+
+
+@app.get("/analytics/{collection}/histogram")
+async def analytics_histogram(collection: str, field: str, bins: int = 10):
+    if collection not in export.EXPORT_FIELDS:
+        return JSONResponse({"error": "Unknown collection"}, status_code=404)
+    try:
+        return await analytics_store.histogram(collection, field, bins)
+    except analytics.AnalyticsError as err:
+        return JSONResponse({"error": str(err)}, status_code=400)
+
+
+def _split(values):
+    return [value.strip() for value in values.split(",") if value.strip()]
+
+# Image Endpoints
+
+@app.get("/img/{path:path}")
+async def resized_image(request: Request, path: str, w: int = 640, fmt: str = "webp"):
+    if fmt not in imaging.FORMATS:
+        return Response("fmt must be webp, jpeg or png", status_code=400)
+    if w < 1:
+        return Response("w must be positive", status_code=400)
+    if path not in SITE_IMAGES and (path.partition("/")[0] not in IMAGE_FIELDS
+                                    or not await referenced_images.check(path)):
+        return Response("Image not found", status_code=404)
+    width = imaging.snap_width(w)
+    etag = image_proxy.etag(path, width, fmt)
+    headers = {"ETag": etag, "Cache-Control": imaging.CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    try:
+        data = await image_proxy.variant(path, width, fmt)
+    except (FileNotFoundError, ValueError):
+        return Response("Image not found", status_code=404)
+    except imaging.ImageError as err:
+        # Not an image Pillow can decode, or too many pixels to decode safely
+        print(f"Could not resize {path}: {err}")
+        return Response("Could not process image", status_code=422)
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = imaging.parse_range(range_header, len(data))
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(data)}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(data[start:end + 1], status_code=206, media_type=imaging.FORMATS[fmt], headers=headers)
+    return Response(data, media_type=imaging.FORMATS[fmt], headers=headers)
+
+# Monitoring Endpoints
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    content, content_type = metrics.render_latest()
+    return Response(content, media_type=content_type)
+
+
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+def probe_firestore(client):
+    list(client.collection("drivers").limit(1).stream())
+
+def probe_auth():
+    # Fetching the token signing certs opens the session verify_firebase_token reuses
+    response = firebase_request_adapter(url=FIREBASE_CERTS_URL, method="GET")
+    if response.status != 200:
+        raise ValueError(f"certificate endpoint returned {response.status}")
+
+readiness_probes = {
+    f"firestore-{index}": functools.partial(firestore_pool.warm_up, index, probe_firestore)
+    for index in range(len(firestore_pool.clients))
+}
+readiness_probes["storage"] = raw_blob_store.probe
+readiness_probes["templates"] = preload_templates
+readiness_probes["jobs"] = job_queue.probe
+# Offline runs (in-memory backend) have no network to reach Google with
+if local_constants.BACKEND == "firestore":
+    readiness_probes["auth"] = probe_auth
+
+health_checker = health.HealthChecker(
+    readiness_probes,
+    local_constants.READY_LATENCY_MS / 1000,
+    local_constants.HEALTH_CACHE_SECONDS,
+)
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: answers from memory and never touches a backend
+    return {"status": "ok", "readiness": health_checker.result}
+
+
+@app.get("/readyz")
+async def readyz():
+    readiness = await health_checker.check()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
+# Admin Endpoints
+
+@app.get("/admin/profiles/{name}")
+async def download_profile(request: Request, name: str):
+    if not is_admin(request.cookies.get("token")):
+        return HTMLResponse("Forbidden", status_code=403)
+    path = profiling.profile_path(name)
+    if path is None:
+        return HTMLResponse("Profile not found", status_code=404)
+    return FileResponse(path, media_type="application/json", filename=name)
+
+
+@app.get("/admin/loop-blocks")
+async def loop_blocks(request: Request):
+    if not is_admin(request.cookies.get("token")):
+        return HTMLResponse("Forbidden", status_code=403)
+    return list(loopwatch.watchdog.events)
+
+
+@app.get("/admin/memory")
+async def memory_report(request: Request, limit: int = 20, group: str = "lineno"):
+    if not is_admin(request.cookies.get("token")):
+        return HTMLResponse("Forbidden", status_code=403)
+    if group not in ("lineno", "filename", "traceback"):
+        return HTMLResponse("group must be lineno, filename or traceback", status_code=400)
+    return memprof.profiler.report(limit=limit, key_type=group)
+
+
+@app.post("/admin/memory/start")
+async def memory_start(request: Request, frames: int = 1):
+    if not is_admin(request.cookies.get("token")):
+        return HTMLResponse("Forbidden", status_code=403)
+    if frames < 1:
+        return JSONResponse({"error": "frames must be at least 1"}, status_code=400)
+    active = memprof.profiler.frames()
+    if active is not None and active != frames:
+        # tracemalloc can't change its frame count while tracing
+        return JSONResponse({"error": f"Already tracing with {active} frames; stop first to change it",
+                             "tracing": True, "frames": active}, status_code=409)
+    return {"tracing": True, "frames": memprof.profiler.start(frames)}
+
+
+@app.post("/admin/memory/baseline")
+async def memory_baseline(request: Request):
+    if not is_admin(request.cookies.get("token")):
+        return HTMLResponse("Forbidden", status_code=403)
+    memprof.profiler.reset_baseline()
+    return {"baseline": "reset"}
+
+
+@app.post("/admin/memory/stop")
+async def memory_stop(request: Request):
+    if not is_admin(request.cookies.get("token")):
+        return HTMLResponse("Forbidden", status_code=403)
+    memprof.profiler.stop()
+    return {"tracing": False}
+
+
+@app.get("/admin/jobs")
+async def job_stats(request: Request):
+    if not is_admin(request.cookies.get("token")):
+        return HTMLResponse("Forbidden", status_code=403)
+    return await run_in_threadpool(job_queue.stats)
 
-def seed_sample_data():
-    drivers_ref = firestore_db.collection("drivers")
-    if not any(drivers_ref.stream()):
-        sample_drivers = [
-            {
-                "name": "Lewis Hamilton",
-                "age": 37,
-                "total_pole_positions": 100,
-                "total_race_wins": 104,
-                "total_points_scored": 5000,
-                "total_world_titles": 7,
-                "total_fastest_laps": 50,
-                "team": "Ferrari",
-                "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/lewis.png",
-            },
-            {
-                "name": "Max Verstappen",
-                "age": 25,
-                "total_pole_positions": 60,
-                "total_race_wins": 50,
-                "total_points_scored": 3000,
-                "total_world_titles": 2,
-                "total_fastest_laps": 30,
-                "team": "Red Bull",
-                "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/max.png",
-            },
-            {
-                "name": "Charles Leclerc",
-                "age": 26,
-                "total_pole_positions": 20,
-                "total_race_wins": 5,
-                "total_points_scored": 1200,
-                "total_world_titles": 0,
-                "total_fastest_laps": 10,
-                "team": "Ferrari",
-                "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/leclerc.png",
-            },
-            {
-                "name": "Lando Norris",
-                "age": 23,
-                "total_pole_positions": 5,
-                "total_race_wins": 4,
-                "total_points_scored": 800,
-                "total_world_titles": 0,
-                "total_fastest_laps": 10,
-                "team": "McClaren",
-                "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/norris.png",
-            },
-            {
-                "name": "George Russel",
-                "age": 24,
-                "total_pole_positions": 3,
-                "total_race_wins": 2,
-                "total_points_scored": 900,
-                "total_world_titles": 0,
-                "total_fastest_laps": 6,
-                "team": "Mercedes",
-                "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/russel.png",
-            },
-            {
-                "name": "Alex Albon",
-                "age": 25,
-                "total_pole_positions": 1,
-                "total_race_wins": 2,
-                "total_points_scored": 850,
-                "total_world_titles": 0,
-                "total_fastest_laps": 3,
-                "team": "Williams",
-                "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/albon.png",
-            },
-        ]
-        for driver in sample_drivers:
-            firestore_db.collection("drivers").add(driver)
-
-    teams_ref = firestore_db.collection("teams")
-    if not any(teams_ref.stream()):
-        sample_teams = [
-            {
-                "name": "Mercedes",
-                "year_founded": 1954,
-                "total_pole_positions": 150,
-                "total_race_wins": 120,
-                "total_constructor_titles": 8,
-                "finishing_position_previous_season": 1,
-                "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/Mercedes.png",
-            },
-            {
-                "name": "Red Bull",
-                "year_founded": 2005,
-                "total_pole_positions": 100,
-                "total_race_wins": 90,
-                "total_constructor_titles": 4,
-                "finishing_position_previous_season": 2,
-                "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/red-bull.jpg",
-            },
-            {
-                "name": "Ferrari",
-                "year_founded": 1929,
-                "total_pole_positions": 130,
-                "total_race_wins": 110,
-                "total_constructor_titles": 16,
-                "finishing_position_previous_season": 3,
-                "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/Ferrari.png",
-            },
-            {
-                "name": "Mclaren",
-                "year_founded": 1963,
-                "total_pole_positions": 164,
-                "total_race_wins": 191,
-                "total_constructor_titles": 9,
-                "finishing_position_previous_season": 1,
-                "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/Mclaren.png",
-            },
-            {
-                "name": "Williams",
-                "year_founded": 1985,
-                "total_pole_positions": 100,
-                "total_race_wins": 30,
-                "total_constructor_titles": 2,
-                "finishing_position_previous_season": 10,
-                "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/williams.png",
-            },
-        ]
-        for team in sample_teams:
-            firestore_db.collection("teams").add(team)
 
 @app.on_event("startup")
 async def startup_event():
-    seed_sample_data()
+    # Under serve.py --preload the master's gauge samples are dropped before forking, so
+    # each worker writes its own; the readiness check below reports the template cache
+    firestore_breaker.report()
+    image_proxy.cache.report_size()
+    # Open every backend connection before taking traffic
+    readiness = await health_checker.check()
+    if not readiness["ready"]:
+        print("Startup readiness checks failed:", readiness["checks"])
+    if local_constants.SEED_ON_STARTUP:
+        seed.seed_sample_data(firestore_db)
+    loopwatch.watchdog.start()
+    job_queue.start(local_constants.JOB_WORKERS, local_constants.JOB_POLL_MS / 1000)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await loopwatch.watchdog.stop()
+    await job_queue.stop()
+    image_proxy.close()
 
 
 if __name__ == "__main__":
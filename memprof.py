@@ -0,0 +1,130 @@
+import os
+import threading
+import tracemalloc
+
+import metrics
+
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+class MemoryProfiler:
+    def __init__(self):
+        self.baseline = None
+        self.route_stats = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def start(self, frames=1):
+        # Tracing that is already on keeps its frame count; returns the one in effect
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.route_stats = {}
+        self.baseline = self._snapshot()
+        return tracemalloc.get_traceback_limit()
+
+    def frames(self):
+        """Traceback frames being recorded, or None when not tracing."""
+        return tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else None
+
+    def stop(self):
+        tracemalloc.stop()
+        self.baseline = None
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def report(self, limit=20, key_type="lineno"):
+        if not tracemalloc.is_tracing():
+            return {"tracing": False, "rss_bytes": rss_bytes()}
+        snapshot = self._snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            "tracing": True,
+            "rss_bytes": rss_bytes(),
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "top": [{"site": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                    for stat in snapshot.statistics(key_type)[:limit]],
+            "routes": self.route_summary(),
+        }
+        if self.baseline is not None:
+            # Growth since tracing started; steadily growing sites point at leaks and unbounded caches
+            report["growth"] = [
+                {"site": str(stat.traceback), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in snapshot.compare_to(self.baseline, key_type)[:limit]
+            ]
+        return report
+
+    def reset_baseline(self):
+        if tracemalloc.is_tracing():
+            self.baseline = self._snapshot()
+
+    def request_started(self):
+        with self._lock:
+            self._in_flight += 1
+            exclusive = self._in_flight == 1
+            if exclusive:
+                tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+        return current, exclusive
+
+    def request_finished(self, route, start_current, exclusive):
+        with self._lock:
+            self._in_flight -= 1
+            current, peak = tracemalloc.get_traced_memory()
+            exclusive = exclusive and self._in_flight == 0
+            stats = self.route_stats.setdefault(route, {
+                "requests": 0, "exclusive_requests": 0, "peak_bytes_max": 0, "peak_bytes_total": 0, "retained_bytes": 0,
+            })
+            stats["requests"] += 1
+            stats["retained_bytes"] += current - start_current
+            # Peaks are only attributable when no other request overlapped this one
+            if exclusive:
+                peak_delta = max(0, peak - start_current)
+                stats["exclusive_requests"] += 1
+                stats["peak_bytes_max"] = max(stats["peak_bytes_max"], peak_delta)
+                stats["peak_bytes_total"] += peak_delta
+
+    def route_summary(self):
+        summary = {}
+        for route, stats in self.route_stats.items():
+            exclusive = stats["exclusive_requests"]
+            summary[route] = {
+                "requests": stats["requests"],
+                "exclusive_requests": exclusive,
+                "peak_bytes_max": stats["peak_bytes_max"],
+                "peak_bytes_mean": stats["peak_bytes_total"] // exclusive if exclusive else None,
+                "retained_bytes_mean": stats["retained_bytes"] // stats["requests"],
+            }
+        return summary
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+profiler = MemoryProfiler()
+
+
+class MemoryProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracemalloc.is_tracing():
+            await self.app(scope, receive, send)
+            return
+        start_current, exclusive = profiler.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.request_finished(metrics.route_label(scope), start_current, exclusive)
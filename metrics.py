@@ -0,0 +1,169 @@
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+REQUEST_LATENCY = Histogram(
+    "f1_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+BACKEND_CALLS = Counter(
+    "f1_backend_calls_total",
+    "Firestore and Cloud Storage calls",
+    ["backend", "operation", "collection", "outcome"],
+)
+BACKEND_LATENCY = Histogram(
+    "f1_backend_call_duration_seconds",
+    "Firestore and Cloud Storage call latency",
+    ["backend", "operation", "collection"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+BACKEND_DOCUMENTS = Counter(
+    "f1_backend_documents_total",
+    "Documents read or written by backend calls",
+    ["backend", "operation", "collection"],
+)
+LOOP_LAG = Histogram(
+    "f1_event_loop_lag_seconds",
+    "How late the event loop ran a scheduled wake-up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_BLOCKS = Counter(
+    "f1_event_loop_blocked_total",
+    "Times a callback held the event loop longer than the blocking threshold",
+    ["route"],
+)
+POOL_IN_FLIGHT = Gauge(
+    "f1_client_pool_in_flight",
+    "Requests currently pinned to each pooled backend client",
+    ["pool", "client"],
+    multiprocess_mode="livesum",
+)
+POOL_ACQUIRED = Counter(
+    "f1_client_pool_acquired_total",
+    "Requests assigned to each pooled backend client",
+    ["pool", "client"],
+)
+BREAKER_STATE = Gauge(
+    "f1_circuit_breaker_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ["backend"],
+    multiprocess_mode="liveall",
+)
+BREAKER_TRIPS = Counter("f1_circuit_breaker_trips_total", "Times the circuit breaker opened", ["backend"])
+STALE_READS = Counter(
+    "f1_stale_reads_total",
+    "Reads answered from the last known good copy (served) or failed with none cached (miss)",
+    ["outcome"],
+)
+HEDGED_READS = Counter(
+    "f1_hedged_reads_total",
+    "Hedged single-document reads: issued, won (duplicate answered first), lost, skipped (over budget)",
+    ["collection", "outcome"],
+)
+ADMISSION_QUEUE_TIME = Histogram(
+    "f1_admission_queue_seconds",
+    "Time requests waited for a concurrency slot, by route group",
+    ["group"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+ADMISSION_REJECTED = Counter(
+    "f1_admission_rejected_total",
+    "Requests shed with 503 because their route group was saturated",
+    ["group", "reason"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "f1_admission_in_flight",
+    "Requests currently holding a concurrency slot, by route group",
+    ["group"],
+    multiprocess_mode="livesum",
+)
+IMAGE_RESIZE_SECONDS = Histogram(
+    "f1_image_resize_seconds",
+    "Time to resize and encode one image variant in the process pool, by output format",
+    ["format"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+JOBS = Counter(
+    "f1_jobs_total",
+    "Background jobs by kind and outcome: enqueued, duplicate (same idempotency key), succeeded, retried, failed",
+    ["kind", "outcome"],
+)
+JOB_LAG = Histogram(
+    "f1_job_lag_seconds",
+    "Time from enqueueing a background job to its successful completion",
+    ["kind"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 15.0, 60.0, 300.0),
+)
+FILTER_QUERIES = Counter(
+    "f1_filter_queries_total",
+    "Filter-expression queries by where they ran: table (cached column table), firestore, or load (table loaded for it)",
+    ["collection", "source"],
+)
+CACHE_HITS = Counter("f1_cache_hits_total", "Cache hits", ["cache"])
+CACHE_MISSES = Counter("f1_cache_misses_total", "Cache misses", ["cache"])
+# Caches are per process, so each worker reports its own series (pid label)
+CACHE_ENTRIES = Gauge("f1_cache_entries", "Entries currently held in a cache", ["cache"], multiprocess_mode="liveall")
+
+
+def observe_backend_call(backend, operation, collection, duration, documents, error, latency):
+    BACKEND_CALLS.labels(backend, operation, collection, "error" if error else "ok").inc()
+    BACKEND_LATENCY.labels(backend, operation, collection).observe(duration)
+    if documents:
+        BACKEND_DOCUMENTS.labels(backend, operation, collection).inc(documents)
+
+
+def record_cache(cache, hit):
+    (CACHE_HITS if hit else CACHE_MISSES).labels(cache).inc()
+
+
+def set_cache_size(cache, entries):
+    # Called whenever a cache changes: multiprocess mode can't call back into a worker at
+    # scrape time, so the value has to be written out as it changes
+    CACHE_ENTRIES.labels(cache).set(entries)
+
+
+def route_label(scope):
+    # Label by route template (/drivers/{driver_id}) so raw ids don't explode cardinality
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope["path"].startswith("/static/"):
+        return "/static"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(scope["method"], route_label(scope), str(status_code)).observe(
+                time.perf_counter() - started)
+
+
+def render_latest():
+    # Under a multi-worker server each worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import timeit
+import tracemalloc
+from unittest import mock
+
+import numpy as np
+
+# Benchmarks run offline against the in-memory backend and fixed fixtures
+os.environ.setdefault("F1_BACKEND", "memory")
+
+import google.oauth2.id_token
+from starlette.requests import Request
+
+import analytics
+import backends
+import main
+import records
+import seed
+
+RECORD_COUNTS = (10, 100, 1000)
+FOOTPRINT_COUNT = 10000
+ANALYTICS_COUNT = 100000
+USER_CLAIMS = {"user_id": "bench-user", "email": "bench@example.com"}
+
+
+class FixtureDocument:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def make_records(samples, count):
+    records = []
+    for index in range(count):
+        record = dict(samples[index % len(samples)])
+        record["name"] = f"{record['name']} {index}"
+        record["id"] = seed.fixture_id(record["name"])
+        records.append(record)
+    return records
+
+
+def make_request():
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "app": main.app,
+        "router": main.app.router,
+    }
+    return Request(scope)
+
+
+def measure(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    # The minimum over repeats is the least noisy estimate of the real cost
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return best * 1e6
+
+
+def bench_helpers(repeat):
+    results = []
+    with mock.patch.object(google.oauth2.id_token, "verify_firebase_token", return_value=USER_CLAIMS):
+        results.append(("validate_firebase_token", 1, measure(lambda: main.validate_firebase_token("token"), repeat)))
+
+    store = backends.MemoryDocumentStore()
+    store.collection("users").document(USER_CLAIMS["user_id"]).set({"name": "bench", "email": "bench@example.com"})
+    with mock.patch.object(main, "firestore_db", store):
+        results.append(("get_user", 1, measure(lambda: main.get_user(dict(USER_CLAIMS)), repeat)))
+
+    driver1, driver2 = seed.SAMPLE_DRIVERS[:2]
+    team1, team2 = seed.SAMPLE_TEAMS[:2]
+    results.append(("compare_driver_stats", 1, measure(lambda: main.compare_driver_stats(driver1, driver2), repeat)))
+    results.append(("compare_team_stats", 1, measure(lambda: main.compare_team_stats(team1, team2), repeat)))
+
+    for count in RECORD_COUNTS:
+        docs = [FixtureDocument(r.pop("id"), r) for r in make_records(seed.SAMPLE_DRIVERS, count)]
+        results.append(("ColumnTable.from_documents", count,
+                        measure(lambda: records.ColumnTable.from_documents("drivers", docs), repeat)))
+    return results
+
+
+def template_contexts(count):
+    # List pages get the column tables read_collection returns; detail and compare pages
+    # get single documents as dicts
+    driver_rows = make_records(seed.SAMPLE_DRIVERS, count)
+    team_rows = make_records(seed.SAMPLE_TEAMS, count)
+    drivers = records.ColumnTable("drivers", driver_rows)
+    teams = records.ColumnTable("teams", team_rows)
+    driver, team = driver_rows[0], team_rows[0]
+    comparison_drivers = main.compare_driver_stats(driver_rows[0], driver_rows[1])
+    comparison_teams = main.compare_team_stats(team_rows[0], team_rows[1])
+    return {
+        "main.html": {"drivers": drivers, "teams": teams, "error_message": "", "user_info": {}},
+        "drivers_list.html": {"drivers": drivers},
+        "teams_list.html": {"teams": teams},
+        "team_details.html": {"team": team, "drivers": drivers},
+        "compare_drivers_form.html": {"drivers": drivers},
+        "compare_teams_form.html": {"teams": teams},
+        "driver_details.html": {"driver": driver},
+        "edit_driver.html": {"driver": driver},
+        "edit_team.html": {"team": team},
+        "compare_drivers.html": {"driver1": driver_rows[0], "driver2": driver_rows[1], "comparison": comparison_drivers},
+        "compare_teams.html": {"team1": team_rows[0], "team2": team_rows[1], "comparison": comparison_teams},
+        "add_driver.html": {},
+        "add_team.html": {},
+        "login.html": {},
+        "query_drivers.html": {},
+        "query_teams.html": {},
+    }
+
+
+# Templates whose output grows with the number of records in the context
+COLLECTION_TEMPLATES = {"main.html", "drivers_list.html", "teams_list.html", "team_details.html",
+                        "compare_drivers_form.html", "compare_teams_form.html"}
+
+
+def bench_templates(repeat):
+    results = []
+    request = make_request()
+    user_token = dict(USER_CLAIMS)
+    for count in RECORD_COUNTS:
+        for name, context in template_contexts(count).items():
+            if name not in COLLECTION_TEMPLATES and count != RECORD_COUNTS[0]:
+                continue
+            context = {"request": request, "user_token": user_token, **context}
+            label_count = count if name in COLLECTION_TEMPLATES else 1
+            results.append((f"render {name}", label_count,
+                            measure(lambda: main.templates.TemplateResponse(name, context), repeat)))
+    return results
+
+
+def bench_analytics(repeat, count=ANALYTICS_COUNT):
+    # Uncached query cost over one column table; the endpoint caches results per data version
+    rows = make_records(seed.SAMPLE_DRIVERS, count)
+    for index, row in enumerate(rows):
+        row["team"] = f"Team {index % 20}"
+        row["total_points_scored"] = index % 4000
+    table = records.ColumnTable("drivers", rows)
+    fields = ["age", "total_race_wins", "total_points_scored"]
+    results = []
+
+    def group_by():
+        index = analytics.GroupIndex(table.column("team"), len(table.categories["team"]))
+        for field in fields:
+            for aggregate in analytics.AGGREGATES:
+                index.aggregate(*table.numbers(field), aggregate)
+
+    def python_group_by():
+        # The same aggregates computed with a loop over dicts, for comparison
+        groups = {}
+        for row in rows:
+            group = groups.setdefault(row["team"], {field: [] for field in fields})
+            for field in fields:
+                group[field].append(row[field])
+        return {team: {field: (len(values), sum(values), sum(values) / len(values), min(values), max(values))
+                       for field, values in group.items()} for team, group in groups.items()}
+
+    results.append(("group_by team, 3 fields x 5 aggs", count, measure(group_by, repeat)))
+    results.append(("group_by team, python loop", count, measure(python_group_by, repeat)))
+    results.append(("histogram, 50 bins", count,
+                    measure(lambda: np.histogram(table.column("total_points_scored"), bins=50), repeat)))
+    return results
+
+
+def traced_bytes(build):
+    # Memory still allocated by build()'s result once it returns
+    tracemalloc.start()
+    try:
+        result = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_footprint(count=FOOTPRINT_COUNT):
+    results = []
+    for collection, samples in (("drivers", seed.SAMPLE_DRIVERS), ("teams", seed.SAMPLE_TEAMS)):
+        rows = make_records(samples, count)
+
+        def snapshots():
+            # Fresh strings per record, as decoded Firestore snapshots would have
+            return [{key: (value + "\0")[:-1] if isinstance(value, str) else value for key, value in row.items()}
+                    for row in rows]
+
+        record_type = records.RECORD_TYPES[collection]
+        results.append((f"{collection} as dicts", count, traced_bytes(snapshots)))
+        results.append((f"{collection} as slots records", count,
+                        traced_bytes(lambda: [record_type(**row) for row in snapshots()])))
+        results.append((f"{collection} as column table", count,
+                        traced_bytes(lambda: records.ColumnTable(collection, snapshots()))))
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the per-request helpers in main.py.")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats per benchmark (default 5)")
+    parser.add_argument("--only", choices=["helpers", "templates", "analytics", "footprint"], help="run one group only")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    if args.only in (None, "helpers"):
+        results += bench_helpers(args.repeat)
+    if args.only in (None, "templates"):
+        results += bench_templates(args.repeat)
+    if args.only in (None, "analytics"):
+        results += bench_analytics(args.repeat)
+
+    footprint = bench_footprint() if args.only in (None, "footprint") else []
+
+    if results:
+        print(f"{'benchmark':<40}{'records':>9}{'us/call':>12}{'us/record':>12}")
+        for name, count, micros in results:
+            print(f"{name:<40}{count:>9}{micros:>12.2f}{micros / count:>12.3f}")
+    if footprint:
+        print(f"{'footprint':<40}{'records':>9}{'KiB':>12}{'B/record':>12}")
+        for name, count, size in footprint:
+            print(f"{name:<40}{count:>9}{size / 1024:>12.1f}{size / count:>12.1f}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump([{"benchmark": name, "records": count, "us_per_call": round(micros, 3)}
+                       for name, count, micros in results]
+                      + [{"footprint": name, "records": count, "bytes": size} for name, count, size in footprint],
+                      output, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
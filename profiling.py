@@ -0,0 +1,237 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from starlette.requests import Request
+
+import local_constants
+
+# Leaf-most matching frame decides which component a sample is charged to
+CATEGORIES = [
+    ("firestore", ("google/cloud/firestore", "google/api_core", "grpc/", "backends.py")),
+    ("storage", ("google/cloud/storage", "google/resumable_media")),
+    ("auth", ("google/oauth2", "google/auth", "cachecontrol")),
+    ("render", ("jinja2/", "starlette/templating.py")),
+]
+
+_active = contextvars.ContextVar("active_profiler", default=None)
+
+
+def categorize(stack):
+    for frame in reversed(stack):
+        filename = frame[1].replace(os.sep, "/")
+        for category, patterns in CATEGORIES:
+            if any(pattern in filename for pattern in patterns):
+                return category
+    return "app"
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id, anchor_frame, interval):
+        # thread id -> frame that bounds this request's part of that thread's stack
+        self.threads = {thread_id: anchor_frame}
+        self.interval = interval
+        self.samples = []
+        self.started = None
+        self.finished = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.finished = time.perf_counter()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            frames = sys._current_frames()
+            for thread_id, anchor_frame in list(self.threads.items()):
+                stack = self._stack(frames.get(thread_id), anchor_frame)
+                if stack is not None:
+                    self.samples.append((stack, now - last))
+            last = now
+
+    def add_thread(self, thread_id, anchor_frame):
+        self.threads[thread_id] = anchor_frame
+
+    def remove_thread(self, thread_id):
+        self.threads.pop(thread_id, None)
+
+    def _stack(self, frame, anchor_frame):
+        # The event loop interleaves other requests; only keep samples taken while
+        # this request's own coroutine chain (anchored at the middleware) is running
+        stack = []
+        anchored = False
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, frame.f_lineno))
+            if frame is anchor_frame:
+                anchored = True
+                break
+            frame = frame.f_back
+        if not anchored:
+            return None
+        stack.reverse()
+        return stack
+
+    def breakdown(self):
+        totals = {}
+        for stack, weight in self.samples:
+            category = categorize(stack)
+            totals[category] = totals.get(category, 0.0) + weight
+        return totals
+
+    def summary_header(self):
+        totals = self.breakdown()
+        sampled = sum(totals.values()) or 1.0
+        parts = [f"samples={len(self.samples)}"]
+        parts += [f"{category}={totals[category] / sampled:.0%}" for category in sorted(totals)]
+        return "; ".join(parts)
+
+    def speedscope(self, name):
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        for stack, weight in self.samples:
+            indices = []
+            for frame in stack:
+                key = (frame[0], frame[1])
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(frame_index[key])
+            samples.append(indices)
+            weights.append(weight)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "f1-database-profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": (self.finished or time.perf_counter()) - self.started,
+                "samples": samples,
+                "weights": weights,
+            }],
+            "breakdown_seconds": self.breakdown(),
+        }
+
+
+def sampled(call):
+    # Runs in a fan-out worker thread: while a profiled request waits on parallel
+    # backend calls, sample those threads too
+    profiler = _active.get()
+    if profiler is None:
+        return call()
+    thread_id = threading.get_ident()
+    profiler.add_thread(thread_id, sys._getframe())
+    try:
+        return call()
+    finally:
+        profiler.remove_thread(thread_id)
+
+
+def save_profile(profile):
+    os.makedirs(local_constants.PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.speedscope.json"
+    with open(os.path.join(local_constants.PROFILE_DIR, name), "w") as output:
+        json.dump(profile, output)
+    return name
+
+
+def profile_path(name):
+    # Only bare file names produced by save_profile are served
+    if os.path.basename(name) != name or not name.endswith(".speedscope.json"):
+        return None
+    path = os.path.join(local_constants.PROFILE_DIR, name)
+    return path if os.path.exists(path) else None
+
+
+def requested_mode(request):
+    mode = request.headers.get("x-profile") or request.query_params.get("profile")
+    return mode if mode in ("1", "speedscope") else None
+
+
+class ProfilingMiddleware:
+    # Opt-in per request with "X-Profile: 1" or "?profile=1" (saved, name returned in a
+    # header) or "speedscope" (the profile replaces the response body). Admins only.
+
+    def __init__(self, app, is_admin):
+        self.app = app
+        self.is_admin = is_admin
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        mode = requested_mode(request)
+        if mode is None or not self.is_admin(request.cookies.get("token")):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(threading.get_ident(), sys._getframe(),
+                                    local_constants.PROFILE_INTERVAL_MS / 1000)
+        token = _active.set(profiler)
+        try:
+            await self._profile(profiler, mode, scope, receive, send)
+        finally:
+            _active.reset(token)
+
+    async def _profile(self, profiler, mode, scope, receive, send):
+        name = f"{scope['method']} {scope['path']}"
+        if mode == "speedscope":
+            await self._respond_with_profile(profiler, name, scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profiler.stop()
+                profile_name = save_profile(profiler.speedscope(name))
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile", profile_name.encode()),
+                    (b"x-profile-summary", profiler.summary_header().encode()),
+                ]
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler.finished is None:
+                profiler.stop()
+
+    async def _respond_with_profile(self, profiler, name, scope, receive, send):
+        async def discard(message):
+            pass
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            profiler.stop()
+        body = json.dumps(profiler.speedscope(name)).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"x-profile-summary", profiler.summary_header().encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
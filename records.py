@@ -0,0 +1,229 @@
+import sys
+
+import export
+
+# NumPy is the largest single import at startup and only column tables need it, so
+# (as in analytics.py and filters.py) it is imported inside the functions that use it.
+# Firestore integers are signed 64-bit, so any stored value fits
+NUMERIC_DTYPE = "int64"
+NUMERIC_RANGE = (-2 ** 63, 2 ** 63 - 1)
+# Columns with few distinct values, stored as integer codes into an interned list
+CATEGORY_FIELDS = {"team"}
+# Why a numeric cell has no value, for columns that have gaps
+PRESENT, NULL, MISSING = 0, 1, 2
+
+
+class _Absent:
+    # Placeholder for a field the document doesn't have, as opposed to a stored null
+    __slots__ = ()
+
+    def __repr__(self):
+        return "ABSENT"
+
+
+ABSENT = _Absent()
+
+
+class Record:
+    # Row view over a ColumnTable: attribute access for templates, plus enough of the
+    # dict interface (`record["name"]`, get, to_dict) for code written against to_dict().
+    # A field the document lacks is left unset, so it renders blank like a missing key.
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for field, value in values.items():
+            if value is not ABSENT:
+                setattr(self, field, value)
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def keys(self):
+        return [field for field in self.__slots__ if hasattr(self, field)]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.keys()}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class DriverRecord(Record):
+    __slots__ = tuple(export.DRIVER_FIELDS)
+
+
+class TeamRecord(Record):
+    __slots__ = tuple(export.TEAM_FIELDS)
+
+
+RECORD_TYPES = {"drivers": DriverRecord, "teams": TeamRecord}
+
+
+class ColumnTable:
+    # Struct-of-arrays copy of a collection: one NumPy array per numeric field, integer
+    # codes plus an interned value list for category fields, and plain lists for the
+    # remaining strings. Rows are materialized as Records only while iterating.
+    # A numeric column with nulls or missing fields also keeps a `missing` code array;
+    # one holding anything but integers stays a plain list, so values are never altered.
+
+    def __init__(self, collection, rows):
+        self.collection = collection
+        self.record_type = RECORD_TYPES[collection]
+        self.fields = self.record_type.__slots__
+        self.numeric = [field for field in self.fields if field in export.NUMERIC_FIELDS]
+        self.columns = {}
+        self.categories = {}
+        self.missing = {}
+        for field in self.fields:
+            values = [row.get(field, ABSENT) for row in rows]
+            numbers = _encode_numbers(values) if field in export.NUMERIC_FIELDS else None
+            if numbers is not None:
+                self.columns[field], missing = numbers
+                if missing is not None:
+                    self.missing[field] = missing
+            elif field in CATEGORY_FIELDS:
+                self.columns[field], self.categories[field] = _encode(values)
+            else:
+                self.columns[field] = values
+        self._length = len(rows)
+
+    @classmethod
+    def from_documents(cls, collection, docs):
+        rows = []
+        for doc in docs:
+            row = doc.to_dict()
+            row["id"] = doc.id
+            rows.append(row)
+        return cls(collection, rows)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        import numpy as np
+        return next(self._records(np.array([index])))
+
+    def __iter__(self):
+        return self._records(None)
+
+    def select(self, mask):
+        """Records for the rows where the boolean array `mask` is set."""
+        import numpy as np
+        return list(self._records(np.flatnonzero(mask)))
+
+    def _records(self, indices):
+        # Whole columns are converted to Python values once instead of per cell
+        import numpy as np
+        columns = []
+        for field in self.fields:
+            column = self.columns[field]
+            if indices is not None:
+                column = column[indices] if isinstance(column, np.ndarray) else [column[i] for i in indices.tolist()]
+            if field in self.categories:
+                categories = self.categories[field]
+                column = [categories[code] for code in column.tolist()]
+            elif isinstance(column, np.ndarray):
+                column = _restore_missing(column.tolist(), self.missing.get(field), indices)
+            columns.append(column)
+        for row in zip(*columns):
+            yield self.record_type(**dict(zip(self.fields, row)))
+
+    def column(self, field):
+        return self.columns[field]
+
+    def present(self, field):
+        """Boolean array of rows holding a value for a numeric field, or None if all do."""
+        import numpy as np
+        missing = self.missing.get(field)
+        if missing is not None:
+            return missing == PRESENT
+        column = self.columns[field]
+        if isinstance(column, np.ndarray):
+            return None
+        return np.fromiter((_is_number(value) for value in column), bool, len(column))
+
+    def numbers(self, field):
+        """(values, present) for a numeric field; values are 0 wherever present is False."""
+        import numpy as np
+        column = self.columns[field]
+        if isinstance(column, np.ndarray):
+            return column, self.present(field)
+        present = self.present(field)
+        # Only columns holding floats or stray types end up here
+        values = np.fromiter((value if ok else 0 for value, ok in zip(column, present.tolist())), np.float64, len(column))
+        return values, present
+
+    def nbytes(self):
+        """Approximate memory held by the table, counting each distinct string once."""
+        import numpy as np
+        total = 0
+        seen = set()
+        for field, column in self.columns.items():
+            if isinstance(column, np.ndarray):
+                total += column.nbytes + (self.missing[field].nbytes if field in self.missing else 0)
+                continue
+            total += sys.getsizeof(column)
+            for value in column:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    total += sys.getsizeof(value)
+        for categories in self.categories.values():
+            total += sys.getsizeof(categories) + sum(sys.getsizeof(value) for value in categories)
+        return total
+
+
+def _encode(values):
+    import numpy as np
+    categories = []
+    codes = {}
+    encoded = np.empty(len(values), np.int32)
+    for index, value in enumerate(values):
+        value = sys.intern(value) if isinstance(value, str) else value
+        if value not in codes:
+            codes[value] = len(categories)
+            categories.append(value)
+        encoded[index] = codes[value]
+    return encoded, categories
+
+
+def _is_number(value):
+    return type(value) in (int, float)
+
+
+def _encode_numbers(values):
+    import numpy as np
+    # Returns (column, missing codes or None), or None unless every value is an integer
+    # in range, a null or absent
+    low, high = NUMERIC_RANGE
+    gaps = False
+    for value in values:
+        if type(value) is int:
+            if not low <= value <= high:
+                return None
+        elif value is None or value is ABSENT:
+            gaps = True
+        else:
+            return None
+    if not gaps:
+        return np.fromiter(values, NUMERIC_DTYPE, len(values)), None
+    column = np.fromiter((value if type(value) is int else 0 for value in values), NUMERIC_DTYPE, len(values))
+    missing = np.fromiter((PRESENT if type(value) is int else NULL if value is None else MISSING for value in values),
+                          np.int8, len(values))
+    return column, missing
+
+
+def _restore_missing(values, missing, indices):
+    import numpy as np
+    if missing is None:
+        return values
+    if indices is not None:
+        missing = missing[indices]
+    for position in np.flatnonzero(missing).tolist():
+        values[position] = None if missing[position] == NULL else ABSENT
+    return values
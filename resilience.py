@@ -0,0 +1,134 @@
+import collections
+import contextvars
+import threading
+import time
+
+import metrics
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+_stale_reads = contextvars.ContextVar("stale_reads", default=None)
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Trips after `failure_threshold` consecutive failed or slow calls, fails fast for
+    # `reset_timeout` seconds, then lets a single trial call decide whether to close again.
+    # Fed by the backend observer hook, so every Firestore call counts. A call is slow when
+    # its longest single RPC is, so a large stream of fast batches is not a slow call.
+
+    def __init__(self, name, failure_threshold, slow_call, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+        self._lock = threading.Lock()
+        self.report()
+
+    def report(self):
+        metrics.BREAKER_STATE.labels(self.name).set({CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[self.state])
+
+    def _set_state(self, state):
+        self.state = state
+        self.report()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                self._trial_started = None
+            if self.state == HALF_OPEN:
+                # One trial at a time; a trial that never reports back frees the slot after reset_timeout
+                if self._trial_started is None or now - self._trial_started >= self.reset_timeout:
+                    self._trial_started = now
+                    return True
+            return False
+
+    def check(self):
+        # Used as the document store's admit hook: every Firestore call, read or write,
+        # fails fast while the breaker is open
+        if not self.allow():
+            raise BackendUnavailable(f"{self.name} circuit breaker is open")
+
+    def record(self, latency, error):
+        failed = error is not None or latency > self.slow_call
+        with self._lock:
+            if not failed:
+                self.failures = 0
+                if self.state != CLOSED:
+                    self._set_state(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+                metrics.BREAKER_TRIPS.labels(self.name).inc()
+
+    def observe_backend_call(self, backend, operation, collection, duration, documents, error, latency):
+        if backend == self.name:
+            self.record(latency, error)
+
+
+class StaleCache:
+    # Last known good result of each read, served while the backend is failing or the
+    # breaker is open. Bounded LRU; entries are only read on the failure path.
+
+    def __init__(self, breaker, max_entries):
+        self.breaker = breaker
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _fallback(self, key, err):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            metrics.STALE_READS.labels("miss").inc()
+            raise BackendUnavailable(f"{self.breaker.name} unavailable and no cached copy of {key}") from err
+        metrics.STALE_READS.labels("served").inc()
+        stale_reads = _stale_reads.get()
+        if stale_reads is not None:
+            stale_reads.append(key)
+        return entry[0]
+
+    def read(self, key, call):
+        # The breaker itself is checked by the store before each call
+        try:
+            value = call()
+        except BackendUnavailable as err:
+            return self._fallback(key, err)
+        except Exception as err:
+            print(f"Serving cached {key} after backend error: {err}")
+            return self._fallback(key, err)
+        self._store(key, value)
+        return value
+
+    def reader(self, key, call):
+        return lambda: self.read(key, call)
+
+
+def track_stale_reads():
+    # Call from the request's coroutine before fanning out: worker threads append to the
+    # same list, and the handler sees it afterwards through served_stale()
+    _stale_reads.set([])
+
+
+def served_stale():
+    return bool(_stale_reads.get())
@@ -0,0 +1,153 @@
+import re
+
+SAMPLE_DRIVERS = [
+    {
+        "name": "Lewis Hamilton",
+        "age": 37,
+        "total_pole_positions": 100,
+        "total_race_wins": 104,
+        "total_points_scored": 5000,
+        "total_world_titles": 7,
+        "total_fastest_laps": 50,
+        "team": "Ferrari",
+        "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/lewis.png",
+    },
+    {
+        "name": "Max Verstappen",
+        "age": 25,
+        "total_pole_positions": 60,
+        "total_race_wins": 50,
+        "total_points_scored": 3000,
+        "total_world_titles": 2,
+        "total_fastest_laps": 30,
+        "team": "Red Bull",
+        "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/max.png",
+    },
+    {
+        "name": "Charles Leclerc",
+        "age": 26,
+        "total_pole_positions": 20,
+        "total_race_wins": 5,
+        "total_points_scored": 1200,
+        "total_world_titles": 0,
+        "total_fastest_laps": 10,
+        "team": "Ferrari",
+        "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/leclerc.png",
+    },
+    {
+        "name": "Lando Norris",
+        "age": 23,
+        "total_pole_positions": 5,
+        "total_race_wins": 4,
+        "total_points_scored": 800,
+        "total_world_titles": 0,
+        "total_fastest_laps": 10,
+        "team": "McClaren",
+        "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/norris.png",
+    },
+    {
+        "name": "George Russel",
+        "age": 24,
+        "total_pole_positions": 3,
+        "total_race_wins": 2,
+        "total_points_scored": 900,
+        "total_world_titles": 0,
+        "total_fastest_laps": 6,
+        "team": "Mercedes",
+        "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/russel.png",
+    },
+    {
+        "name": "Alex Albon",
+        "age": 25,
+        "total_pole_positions": 1,
+        "total_race_wins": 2,
+        "total_points_scored": 850,
+        "total_world_titles": 0,
+        "total_fastest_laps": 3,
+        "team": "Williams",
+        "image_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/albon.png",
+    },
+]
+
+SAMPLE_TEAMS = [
+    {
+        "name": "Mercedes",
+        "year_founded": 1954,
+        "total_pole_positions": 150,
+        "total_race_wins": 120,
+        "total_constructor_titles": 8,
+        "finishing_position_previous_season": 1,
+        "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/Mercedes.png",
+    },
+    {
+        "name": "Red Bull",
+        "year_founded": 2005,
+        "total_pole_positions": 100,
+        "total_race_wins": 90,
+        "total_constructor_titles": 4,
+        "finishing_position_previous_season": 2,
+        "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/red-bull.jpg",
+    },
+    {
+        "name": "Ferrari",
+        "year_founded": 1929,
+        "total_pole_positions": 130,
+        "total_race_wins": 110,
+        "total_constructor_titles": 16,
+        "finishing_position_previous_season": 3,
+        "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/Ferrari.png",
+    },
+    {
+        "name": "Mclaren",
+        "year_founded": 1963,
+        "total_pole_positions": 164,
+        "total_race_wins": 191,
+        "total_constructor_titles": 9,
+        "finishing_position_previous_season": 1,
+        "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/Mclaren.png",
+    },
+    {
+        "name": "Williams",
+        "year_founded": 1985,
+        "total_pole_positions": 100,
+        "total_race_wins": 30,
+        "total_constructor_titles": 2,
+        "finishing_position_previous_season": 10,
+        "logo_url": "https://storage.googleapis.com/assignment01-453218.appspot.com/williams.png",
+    },
+]
+
+
+def fixture_id(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def collection_is_empty(collection_ref):
+    return not list(collection_ref.limit(1).stream())
+
+
+def seed_sample_data(db):
+    # Deterministic document ids make the batch idempotent: workers racing on an
+    # empty database all write the same documents instead of duplicating them.
+    batch = db.batch()
+    seeded = []
+    for collection, records in (("drivers", SAMPLE_DRIVERS), ("teams", SAMPLE_TEAMS)):
+        collection_ref = db.collection(collection)
+        if not collection_is_empty(collection_ref):
+            continue
+        for record in records:
+            batch.set(collection_ref.document(fixture_id(record["name"])), record)
+        seeded.append(collection)
+    if seeded:
+        batch.commit()
+    return seeded
+
+
+if __name__ == "__main__":
+    import backends
+
+    seeded = seed_sample_data(backends.create_document_store())
+    if seeded:
+        print("Seeded sample data for:", ", ".join(seeded))
+    else:
+        print("Sample data already present, nothing to seed.")
@@ -0,0 +1,96 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from uvicorn.workers import UvicornWorker
+
+
+class ConfiguredUvicornWorker(UvicornWorker):
+    # gunicorn imports this class by name after main() has exported the chosen options
+    CONFIG_KWARGS = {"loop": os.environ.get("F1_LOOP", "auto"), "http": os.environ.get("F1_HTTP", "auto")}
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def run(args):
+    from gunicorn.app.base import BaseApplication
+
+    class F1Application(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # With --preload this runs once in the master: imports and templates are shared
+            # copy-on-write by every worker, while backend clients stay lazy and per-worker
+            import main
+            main.preload_templates()
+            # main defers google-auth to keep single-process cold start low; here it is
+            # cheaper to import it once before forking than on each worker's first login
+            import google.oauth2.id_token  # noqa: F401
+            # Likewise NumPy, which records.py only imports once a column table is built
+            import numpy  # noqa: F401
+            if self.cfg.preload_app:
+                # Importing main wrote gauge samples (breaker state, cache sizes) under the
+                # master's pid, which live* gauges would report for as long as it runs.
+                # The master serves nothing, so drop them; each worker writes its own.
+                from prometheus_client import multiprocess
+                multiprocess.mark_process_dead(os.getpid())
+            return main.app
+
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": "serve.ConfiguredUvicornWorker",
+        "preload_app": args.preload,
+        "timeout": args.timeout,
+        "graceful_timeout": args.timeout,
+        "keepalive": args.keepalive,
+        "child_exit": child_exit,
+    }
+    F1Application(options).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the F1 Database app under gunicorn with uvicorn workers.")
+    parser.add_argument("--bind", default=os.environ.get("F1_BIND", "0.0.0.0:8000"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("F1_WORKERS", multiprocessing.cpu_count())),
+                        help="worker processes (default: one per CPU core)")
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default=os.environ.get("F1_LOOP", "auto"),
+                        help="uvicorn event loop (uvloop must be installed)")
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default=os.environ.get("F1_HTTP", "auto"),
+                        help="uvicorn HTTP parser (httptools must be installed)")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="import the app in each worker instead of once before forking")
+    parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument("--keepalive", type=int, default=5)
+    args = parser.parse_args()
+    os.environ["F1_LOOP"] = args.loop
+    os.environ["F1_HTTP"] = args.http
+    os.environ["F1_WORKERS"] = str(args.workers)
+
+    # Every worker writes its metrics to a shared directory so /metrics reports the whole server.
+    # This has to be set before prometheus_client is first imported.
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    created_dir = None
+    if not multiproc_dir:
+        multiproc_dir = created_dir = tempfile.mkdtemp(prefix="f1-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = multiproc_dir
+    try:
+        run(args)
+    finally:
+        if created_dir:
+            shutil.rmtree(created_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
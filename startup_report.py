@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module):
+    # -X importtime writes "import time: self [us] | cumulative | name" to stderr
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=APP_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000})
+    return modules
+
+
+def package_totals(modules):
+    totals = {}
+    for entry in modules:
+        package = entry["module"].split(".")[0]
+        if package == "google":
+            # google.* is a namespace shared by auth, firestore, storage, api_core, ...
+            package = ".".join(entry["module"].split(".")[:3 if entry["module"].startswith("google.cloud") else 2])
+        totals[package] = totals.get(package, 0.0) + entry["self_ms"]
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request_once(url):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as err:
+        status = err.code
+    return status, time.perf_counter() - started
+
+
+def time_to_first_request(path, timeout):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+                              cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise SystemExit(f"Server exited during startup:\n{server.stderr.read().decode()[-2000:]}")
+            if time.perf_counter() - started > timeout:
+                raise SystemExit(f"No response from {url} within {timeout} s")
+            try:
+                status, first_latency = request_once(url)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        ready = time.perf_counter() - started
+        _, warm_latency = request_once(url)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "path": path,
+        "status": status,
+        "time_to_first_response_ms": round(ready * 1000, 1),
+        "first_request_ms": round(first_latency * 1000, 1),
+        "warm_request_ms": round(warm_latency * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import times and time-to-first-request for main.py.")
+    parser.add_argument("--top", type=int, default=20, help="number of modules and packages to list")
+    parser.add_argument("--path", default="/", help="route to request once the server is up (default /)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--skip-server", action="store_true", help="only report import times")
+    parser.add_argument("--budget-ms", type=float, help="exit 1 if time to first response exceeds this")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    modules = import_times("main")
+    main_entry = next(entry for entry in modules if entry["module"] == "main")
+    packages = package_totals(modules)
+    report = {"import_main_ms": main_entry["cumulative_ms"], "packages_ms": packages,
+              "slowest_modules": sorted(modules, key=lambda entry: entry["self_ms"], reverse=True)[:args.top]}
+
+    print(f"import main: {main_entry['cumulative_ms']:.1f} ms")
+    print(f"\n{'package':<36}{'self ms':>10}")
+    for package, total in list(packages.items())[:args.top]:
+        print(f"{package:<36}{total:>10.1f}")
+    print(f"\n{'module':<56}{'self ms':>10}{'cumul ms':>10}")
+    for entry in report["slowest_modules"]:
+        print(f"{entry['module']:<56}{entry['self_ms']:>10.1f}{entry['cumulative_ms']:>10.1f}")
+
+    if not args.skip_server:
+        report["server"] = time_to_first_request(args.path, args.timeout)
+        server = report["server"]
+        print(f"\nTime to first response on {args.path}: {server['time_to_first_response_ms']} ms "
+              f"(status {server['status']}, first request {server['first_request_ms']} ms, "
+              f"warm request {server['warm_request_ms']} ms)")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.budget_ms and "server" in report and report["server"]["time_to_first_response_ms"] > args.budget_ms:
+        print(f"Cold start exceeds budget of {args.budget_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
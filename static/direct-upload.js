@@ -0,0 +1,56 @@
+'use strict'
+
+// Uploads the chosen image straight to the bucket with a signed URL, then submits the
+// form with only the object token. Any failure falls back to the normal multipart post.
+
+async function uploadDirect(form, fileInput) {
+    const file = fileInput.files[0];
+    const signResponse = await fetch("/uploads/sign", {
+        method: "POST",
+        headers: {"Content-Type": "application/json"},
+        body: JSON.stringify({
+            kind: form.dataset.directUpload,
+            record: form.dataset.record || "",
+            filename: file.name,
+            content_type: file.type,
+            size: file.size
+        })
+    });
+    if (!signResponse.ok) {
+        throw new Error("Could not sign upload: " + signResponse.status);
+    }
+    const upload = await signResponse.json();
+
+    const putResponse = await fetch(upload.url, {method: upload.method, headers: upload.headers, body: file});
+    if (!putResponse.ok) {
+        throw new Error("Direct upload failed: " + putResponse.status);
+    }
+    return upload.object;
+}
+
+window.addEventListener("load", function() {
+    document.querySelectorAll("form[data-direct-upload]").forEach(function(form) {
+        const fileInput = form.querySelector("input[type=file]");
+        const objectInput = form.querySelector("input[name='" + fileInput.name + "_object']");
+        let sending = false;
+
+        form.addEventListener("submit", function(event) {
+            if (sending || fileInput.files.length === 0) {
+                return;
+            }
+            event.preventDefault();
+            sending = true;
+            uploadDirect(form, fileInput)
+                .then((objectToken) => {
+                    objectInput.value = objectToken;
+                    fileInput.removeAttribute("name");
+                })
+                .catch((error) => {
+                    console.log(error);
+                })
+                .finally(() => {
+                    form.submit();
+                });
+        });
+    });
+});
@@ -0,0 +1,276 @@
+import hashlib
+import hmac
+import os
+import time
+import uuid
+
+import multipart
+from multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+import local_constants
+
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+IMAGE_TYPES = {content_type for _, content_type in IMAGE_SIGNATURES} | {"image/webp"}
+SNIFF_BYTES = 12
+# Text fields are kept in memory, so their combined size is capped too
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def stored_path(prefix, file_name):
+    # Stored before the rest of the form is validated, so the name must be unique:
+    # discarding it must never remove another record's image
+    return f"{prefix}/{uuid.uuid4().hex[:12]}-{os.path.basename(file_name)}"
+
+
+def sniff_image_type(head):
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class StreamingForm:
+    # Parses a multipart form as the body arrives. Text fields are collected; the one
+    # file field is size-checked and sniffed from its first bytes, then streamed to the
+    # blob store chunk by chunk, so memory per upload stays at one request chunk plus
+    # the store's upload buffer.
+
+    def __init__(self, request, blob_store, file_field, path_prefix, max_bytes, user_id="", record_id="",
+                 claim_upload=None):
+        self.request = request
+        self.blob_store = blob_store
+        self.file_field = file_field
+        self.path_prefix = path_prefix
+        self.max_bytes = max_bytes
+        # A direct-upload token is only accepted from the user, and for the record, it was signed for
+        self.user_id = user_id
+        self.record_id = record_id
+        # claim_upload(path) returns False if the path was already used by an earlier form
+        self.claim_upload = claim_upload
+        self.fields = {}
+        self.file_path = None
+        self.file_url = None
+        self._field_bytes = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._part_name = None
+        self._part_data = b""
+        self._in_file = False
+        self._file_name = None
+        self._file_finished = False
+        self._file_done = False
+        self._pending = []
+        self._head = b""
+        self._size = 0
+        self._writer = None
+
+    # python-multipart callbacks (synchronous; file data is queued for _flush)
+
+    def on_part_begin(self):
+        self._disposition = b""
+        self._part_data = b""
+        self._in_file = False
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise UploadError('Multipart part without a "name"')
+        self._part_name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" in options:
+            if self._part_name != self.file_field or self._file_name is not None:
+                raise UploadError(f"Unexpected file field {self._part_name}")
+            self._in_file = True
+            self._file_name = os.path.basename(options[b"filename"].decode("utf-8", "replace"))
+
+    def on_part_data(self, data, start, end):
+        if self._in_file:
+            self._pending.append(data[start:end])
+            return
+        self._field_bytes += end - start
+        if self._field_bytes > MAX_FIELD_BYTES:
+            raise UploadError("Form fields too large", 413)
+        self._part_data += data[start:end]
+
+    def on_part_end(self):
+        if self._in_file:
+            self._file_finished = True
+        else:
+            self.fields[self._part_name] = self._part_data.decode("utf-8", "replace")
+
+    # Blob writing, off the event loop
+
+    async def _flush(self):
+        if self._pending:
+            data = b"".join(self._pending)
+            self._pending.clear()
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                raise UploadError(f"File too large (limit {self.max_bytes // (1024 * 1024)} MB)", 413)
+            if self._writer is None:
+                self._head += data
+                if len(self._head) < SNIFF_BYTES and not self._file_finished:
+                    return
+                await self._open_writer()
+                data, self._head = self._head, b""
+            await run_in_threadpool(self._writer.write, data)
+        if self._file_finished and not self._file_done:
+            self._file_done = True
+            await self._finish_file()
+
+    async def _open_writer(self):
+        content_type = sniff_image_type(self._head)
+        if content_type is None:
+            raise UploadError("Unsupported image type. Upload a JPEG, PNG, GIF or WebP file.", 415)
+        if not self._file_name:
+            raise UploadError("The uploaded file has no name")
+        self.file_path = stored_path(self.path_prefix, self._file_name)
+        self._writer = await run_in_threadpool(self.blob_store.open_writer, self.file_path, content_type)
+
+    async def _finish_file(self):
+        if self._writer is None:
+            if self._head:
+                await self._open_writer()
+                await run_in_threadpool(self._writer.write, self._head)
+                self._head = b""
+            else:
+                # Browsers send an empty, unnamed part when no file was chosen
+                return
+        self.file_url = await run_in_threadpool(self._writer.close)
+        self._writer = None
+
+    async def parse(self):
+        content_type, params = parse_options_header(self.request.headers.get("content-type", ""))
+        content_length = self.request.headers.get("content-length")
+        content_length = int(content_length) if content_length and content_length.isdigit() else None
+        if content_type == b"application/x-www-form-urlencoded":
+            # No file possible; small enough to parse the usual way
+            if content_length is None or content_length > MAX_FIELD_BYTES:
+                raise UploadError("Form fields too large", 413)
+            self.fields = {name: value for name, value in (await self.request.form()).items()}
+            await self._direct_upload()
+            return self
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadError("Expected a multipart/form-data body")
+        if content_length is not None and content_length > self.max_bytes + MAX_FIELD_BYTES:
+            raise UploadError(f"File too large (limit {self.max_bytes // (1024 * 1024)} MB)", 413)
+
+        parser = multipart.MultipartParser(params[b"boundary"], {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+        try:
+            async for chunk in self.request.stream():
+                parser.write(chunk)
+                await self._flush()
+            parser.finalize()
+            await self._flush()
+        except BaseException:
+            if self._writer is not None:
+                await run_in_threadpool(self._writer.abort)
+                self._writer = None
+            raise
+        await self._direct_upload()
+        return self
+
+    async def _direct_upload(self):
+        # The browser already PUT the file to the bucket and sent back only its object token
+        token = self.fields.get(f"{self.file_field}_object")
+        if token and self.file_url is None:
+            self.file_path, self.file_url = await run_in_threadpool(
+                verify_direct_upload, self.blob_store, token, self.path_prefix, self.user_id, self.record_id,
+                self.max_bytes, self.claim_upload)
+
+    async def discard(self):
+        # Remove a stored file when the rest of the form turns out to be invalid
+        if self.file_url is not None:
+            await run_in_threadpool(self.blob_store.delete, self.file_path)
+            self.file_url = None
+
+
+def _token_signature(kind, user_id, record_id, path, expires_at):
+    message = f"{kind}\n{user_id}\n{record_id}\n{path}\n{expires_at}".encode()
+    return hmac.new(local_constants.UPLOAD_SIGNING_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+
+def object_token(kind, user_id, record_id, path, expires):
+    # Handed to the browser with a signed upload URL; only paths we issued can come back,
+    # on the same kind of form, from the same user, for the same record ("" for a new one)
+    expires_at = int(time.time() + expires)
+    return f"{path}:{expires_at}:{_token_signature(kind, user_id, record_id, path, expires_at)}"
+
+
+def verify_direct_upload(blob_store, token, kind, user_id, record_id, max_bytes, claim_upload=None):
+    if not local_constants.DIRECT_UPLOADS:
+        raise UploadError("Direct uploads are disabled")
+    path, expires_at, signature = (token.rsplit(":", 2) + ["", ""])[:3]
+    if not path or not expires_at.isdigit() or not hmac.compare_digest(
+            signature, _token_signature(kind, user_id, record_id, path, expires_at)):
+        raise UploadError("Invalid upload reference")
+    if int(expires_at) < time.time():
+        raise UploadError("The upload reference has expired. Please upload the file again.")
+    if not path.startswith(f"{kind}/"):
+        raise UploadError("Upload belongs to a different form")
+    # Tokens are single use: a second form pointing at the same object would share it,
+    # and deleting either record would delete the other's image
+    if claim_upload is not None and not claim_upload(path):
+        raise UploadError("This upload was already used. Please upload the file again.", 409)
+    stored = blob_store.head(path, SNIFF_BYTES)
+    if stored is None:
+        raise UploadError("The uploaded file was not found. Please upload it again.")
+    size, head = stored
+    # The bucket takes whatever the browser sends, so check it as we would a streamed upload
+    if size > max_bytes:
+        blob_store.delete(path)
+        raise UploadError(f"File too large (limit {max_bytes // (1024 * 1024)} MB)", 413)
+    if sniff_image_type(head) is None:
+        blob_store.delete(path)
+        raise UploadError("Unsupported image type. Upload a JPEG, PNG, GIF or WebP file.", 415)
+    return path, blob_store.public_url(path)
+
+
+def form_values(fields, names, numeric):
+    values = {}
+    for name in names:
+        if name not in fields:
+            raise UploadError(f"Missing field: {name}")
+        value = fields[name]
+        if name in numeric:
+            try:
+                value = int(value)
+            except ValueError:
+                raise UploadError(f"{name} must be a whole number")
+        values[name] = value
+    return values